@@ -0,0 +1,219 @@
+"""
+Scaling benchmarks of the attribution stages on synthetic journeys.
+
+Run from the project directory:
+
+    python -m benchmarks.run                                   # default grid, writes benchmarks/results/
+    python -m benchmarks.run --rows 10000 --stages markov shapley --output baseline.json
+    python -m benchmarks.run --compare baseline.json           # run and flag slowdowns vs a baseline
+    python -m benchmarks.run --compare baseline.json --against results.json   # compare two files
+
+These are measurements, not tests: the exit code is 1 only when --compare flags a slowdown.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+import mta_algorithms as mta_
+from benchmarks.synthetic import SHOPS, generate_journeys
+from mta_conversion import Mta_Conversion
+from utils.attribution import attribute_all
+from utils.data import prep_data_for_markov_shapley, prepare_data
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+HEURISTICS = ['fta', 'lta', 'linear', 'time-decay', 'position-based']
+
+
+def _prep_data(data: pd.DataFrame) -> Callable:
+    return lambda: prep_data_for_markov_shapley(data)
+
+
+def _heuristics(data: pd.DataFrame) -> Callable:
+    data_shop = prepare_data(data)[0]
+    return lambda: attribute_all(data_shop, SHOPS[0], HEURISTICS)
+
+
+def _markov(data: pd.DataFrame) -> Callable:
+    paths = prep_data_for_markov_shapley(data)[0][SHOPS[0]][1]
+    return lambda: mta_.MTA(paths).markov()
+
+
+def _shapley(data: pd.DataFrame) -> Callable:
+    paths = prep_data_for_markov_shapley(data)[0][SHOPS[0]][1]
+    return lambda: mta_.MTA(paths).shapley()
+
+
+def _order_output(data: pd.DataFrame) -> Callable:
+    conversion = Mta_Conversion(SHOPS)
+    conversion.data = data
+    conversion.prep_data_clean_adid()
+    mta_result = conversion.save_data(conversion.prep_data('adid'), 'adid')
+    hours = (data['journey_end_ts'].max() - data['journey_end_ts'].min()).total_seconds() / 3600 + 1
+    return lambda: conversion.order_output(mta_result, hour=hours)
+
+
+# stage -> setup(data) returning the timed callable; setup itself is not measured
+STAGES: Dict[str, Callable[[pd.DataFrame], Callable]] = {
+    'prep_data_for_markov_shapley': _prep_data,
+    'heuristics': _heuristics,
+    'markov': _markov,
+    'shapley': _shapley,
+    'order_output': _order_output,
+}
+
+
+def measure(fn: Callable, repeat: int = 3) -> Dict[str, float]:
+    """
+    Args:
+        fn (callable): Stage to measure.
+        repeat (int): Timed runs.
+
+    Returns:
+        dict: Best and median wall time in seconds over repeat runs and the peak traced memory in MB of
+        one more run (numpy and pandas allocations included; traced separately as tracing slows the run).
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'median_seconds': float(np.median(times)), 'peak_mb': peak / 2**20}
+
+
+def run(rows: List[int],
+        channels: List[int],
+        lengths: List[float],
+        stages: List[str],
+        repeat: int = 3,
+        seed: int = 0) -> Dict:
+    """
+    Args:
+        rows (list[int]): Journeys per grid point.
+        channels (list[int]): Distinct sources per grid point.
+        lengths (list[float]): Mean path lengths per grid point.
+        stages (list[str]): Any of STAGES.
+        repeat (int): Timed runs per stage.
+        seed (int): Seed of the synthetic journeys.
+
+    Returns:
+        dict: meta (versions, machine, arguments) and one result per grid point and stage.
+    """
+    results = []
+    for n_rows, n_channels, length in itertools.product(rows, channels, lengths):
+        data = generate_journeys(n_rows, n_channels, length, seed=seed)
+        for stage in stages:
+            result = {'stage': stage, 'rows': n_rows, 'channels': n_channels, 'path_length': length}
+            result.update(measure(STAGES[stage](data), repeat))
+            results.append(result)
+            print(f"{stage:30s} rows={n_rows:<8d} channels={n_channels:<4d} path_length={length:<5g}"
+                  f" {result['seconds']:9.4f}s {result['peak_mb']:9.1f}MB", flush=True)
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.2, min_seconds: float = 0.01) -> List[Dict]:
+    """
+    Args:
+        baseline (dict): Output of run used as the reference.
+        current (dict): Output of run to check.
+        threshold (float): Relative slowdown that is flagged, 0.2 = 20% slower.
+        min_seconds (float): Baseline timings below this are too noisy to flag.
+
+    Returns:
+        list[dict]: Grid points present in both with their ratio and whether they are flagged.
+    """
+    key = lambda r: (r['stage'], r['rows'], r['channels'], r['path_length'])
+    reference = {key(r): r for r in baseline['results']}
+
+    rows = []
+    for result in current['results']:
+        if key(result) not in reference:
+            continue
+        old = reference[key(result)]
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        rows.append({
+            'stage': result['stage'], 'rows': result['rows'], 'channels': result['channels'],
+            'path_length': result['path_length'], 'baseline_seconds': old['seconds'],
+            'seconds': result['seconds'], 'ratio': ratio,
+            'peak_mb_ratio': result['peak_mb'] / old['peak_mb'] if old['peak_mb'] > 0 else float('inf'),
+            'slower': ratio > 1 + threshold and old['seconds'] >= min_seconds,
+        })
+
+    return rows
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Scaling benchmarks of the attribution stages.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--lengths', type=float, nargs='+', default=[2.0, 5.0])
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file, benchmarks/results/bench-<time>.json by default')
+    parser.add_argument('--compare', metavar='BASELINE', help='flag slowdowns against this results file')
+    parser.add_argument('--against', metavar='RESULTS', help='compare this results file instead of running')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    # the chained assignments in utils.data warn on every run
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+
+    if args.against:
+        with open(args.against) as f:
+            current = json.load(f)
+    else:
+        current = run(args.rows, args.channels, args.lengths, args.stages, args.repeat, args.seed)
+        output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f'results written to {output}')
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    for r in rows:
+        print(f"{'SLOWER' if r['slower'] else 'ok':6s} {r['stage']:30s} rows={r['rows']:<8d} channels={r['channels']:<4d}"
+              f" path_length={r['path_length']:<5g} {r['baseline_seconds']:9.4f}s -> {r['seconds']:9.4f}s"
+              f" (x{r['ratio']:.2f}, memory x{r['peak_mb_ratio']:.2f})")
+    slower = sum(r['slower'] for r in rows)
+    print(f'{slower} of {len(rows)} grid points slower than the baseline by more than {args.threshold:.0%}')
+
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+SHOPS = ['beauty_shop_1', 'beauty_shop_2']
+
+
+def generate_journeys(n_rows: int,
+                      n_channels: int = 10,
+                      mean_path_length: float = 3.0,
+                      ads_per_channel: int = 5,
+                      conversion_rate: float = 0.3,
+                      days: int = 30,
+                      seed: int = 0) -> pd.DataFrame:
+    """
+    Seeded synthetic journeys shaped like data_for_mvp.
+
+    Path lengths are 1 + Poisson(mean_path_length - 1) capped at 15 (the dashboard limit), channel
+    popularity is Zipf-like, ads are uniform among the ads_per_channel ads of their channel and journeys
+    end uniformly over the first days days of 2024.
+
+    Args:
+        n_rows (int): Number of journeys.
+        n_channels (int): Number of distinct sources.
+        mean_path_length (float): Mean number of touches per journey.
+        ads_per_channel (int): Distinct ad ids per source.
+        conversion_rate (float): Share of successful journeys.
+        days (int): Period covered by journey_end_ts.
+        seed (int): Seed, the same arguments always give the same frame.
+
+    Returns:
+        pd.DataFrame: order_id, shop_name, tw_source, tw_adid, len_tw_source, journey_end_ts,
+        journey_success, total_price and time_between_order_and_step, paths as lists.
+    """
+    rng = np.random.default_rng(seed)
+
+    lengths = np.minimum(1 + rng.poisson(max(mean_path_length - 1, 0), n_rows), 15)
+    n_touches = int(lengths.sum())
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    popularity = 1 / np.arange(1, n_channels + 1)
+    channels = rng.choice(n_channels, n_touches, p=popularity / popularity.sum())
+    ads = channels * ads_per_channel + rng.integers(0, ads_per_channel, n_touches)
+    channel_names = np.array([f'source_{c}' for c in range(n_channels)], dtype=object)
+    ad_names = np.array([f'{a:08d}' for a in range(n_channels * ads_per_channel)], dtype=object)
+
+    # minutes between the touch and the order: the remaining gaps of the path, decreasing along it
+    gaps = rng.exponential(60 * 24, n_touches)
+    elapsed = np.cumsum(gaps)
+    minutes = np.repeat(elapsed[offsets[1:] - 1], lengths) - elapsed + gaps
+
+    split = lambda a: [a[offsets[k]:offsets[k + 1]].tolist() for k in range(n_rows)]
+    success = (rng.random(n_rows) < conversion_rate).astype(int)
+    end = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.sort(rng.integers(0, days * 86400, n_rows)), 's')
+
+    return pd.DataFrame({
+        'order_id': np.arange(n_rows) + 1,
+        'shop_name': rng.choice(SHOPS, n_rows),
+        'tw_source': split(channel_names[channels]),
+        'tw_adid': split(ad_names[ads]),
+        'len_tw_source': lengths,
+        'journey_end_ts': end,
+        'journey_success': success,
+        'total_price': np.where(success == 1, rng.gamma(2.0, 40.0, n_rows).round(2), 0.0),
+        'time_between_order_and_step': split(minutes.round(1)),
+    })
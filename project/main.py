@@ -1,6 +1,6 @@
 # Standard library imports
-import ast
 import itertools
+import os
 import pickle
 
 # Third-party imports
@@ -12,21 +12,22 @@ import numpy as np
 
 # Local module imports
 from utils.etl import download_csv
-from utils.model import train_mmm_model
+from utils.model import MediaMixModel
+from utils.scenarios import ScenarioEngine
+from utils.storage import JOURNEYS_PATH, LIST_COLUMNS, load_journeys
+from utils.parsing import parse_list_columns
+from utils.cache import LRUCache, attribute_cached, bytes_fingerprint, path_fingerprint
+from utils.profiling import Profile, stage
 
+from utils.cube import PathCube
+from utils.bootstrap import bootstrap_cube
 from utils.attribution import (
-    last_touch_attribution,
-    first_touch_attribution,
-    time_decay_attribution,
-    position_based_attribution,
-    markov_attribution,
-    shapley_attribution,
+    attribute_cube,
     mean_channel_attribution_time,
     sorted_mean_channel_attribution_time,
 )
 
 from utils.data import (
-    prep_data_for_markov_shapley,
     prepare_data,
     sort_attribution_result,
 )
@@ -50,19 +51,6 @@ st.write('''Это веб-приложение для анализа атриб
 st.sidebar.title("Загрузка данных")
 file = st.sidebar.file_uploader("Загрузите файл в формате pickle", type="pickle")
 
-if file is not None:
-    data = pd.read_pickle(file)
-    st.success("Данные успешно загружены.")
-else:
-    st.warning("Пожалуйста загрузите данные.")
-    data = pd.read_pickle('data/data_for_mvp.pickle').reset_index(drop=True)
-
-data_revenue = pd.read_csv('data/final_final_mmm.csv')
-data['journey_end_ts'] = pd.to_datetime(data['journey_end_ts']).dt.date
-data = data[data['len_tw_source'] <= 15]
-data_shop_1, data_shop_2 = prepare_data(data)
-models = ['fta', 'lta','linear', 'time-decay', 'position-based', 'markov', 'shapley']
-
 # Interactive sidebar
 selected_shop = st.sidebar.selectbox('Выберите магазин', ['beauty_shop_1', 'beauty_shop_2'])
 selected_number = st.sidebar.slider('Количество платформ/каналов для визуализации', 5, 20) 
@@ -74,28 +62,94 @@ end_date = st.sidebar.date_input('Дата конца периода расче
 if start_date > end_date:
     st.error('Error: End Date must be after Start Date.')
 
+# debug panel: time (and optionally peak memory) of every stage of this rerun
+debug = st.sidebar.checkbox('Отладка: время расчета по этапам')
+profile = Profile('dashboard', memory=debug and st.sidebar.checkbox('Отладка: пиковая память (медленнее)'))
+if debug:
+    profile.start()
+
+# results survive reruns in a bounded LRU cache keyed by a fingerprint of the dataset; entries hold
+# whole journey frames, so the cache is bounded by their estimated size as well as by their number
+@st.cache_resource
+def get_cache() -> LRUCache:
+    return LRUCache(maxsize=128, maxbytes=2 * 2**30)
+
+cache = get_cache()
+
+if file is not None:
+    st.success("Данные успешно загружены.")
+    dataset_key = bytes_fingerprint(file.getvalue())
+    load_key = (dataset_key, 'data')
+elif os.path.isdir(JOURNEYS_PATH):
+    st.warning("Пожалуйста загрузите данные.")
+    dataset_key = path_fingerprint(JOURNEYS_PATH)
+    # only the selected shop is read from the columnar dataset, once; periods are filtered from it
+    load_key = (dataset_key, 'data', selected_shop)
+else:
+    st.warning("Пожалуйста загрузите данные.")
+    dataset_key = path_fingerprint('data/data_for_mvp.pickle')
+    load_key = (dataset_key, 'data')
+
+
+def load_data():
+    # the whole history of a shop, for the channel and path length plots and the path cube; the
+    # selected period is filtered from it below
+    if file is not None:
+        # uploaded exports may hold the paths as serialized lists
+        data = parse_list_columns(pd.read_pickle(file), LIST_COLUMNS)
+    elif os.path.isdir(JOURNEYS_PATH):
+        data = load_journeys(JOURNEYS_PATH, shop=selected_shop)
+    else:
+        data = pd.read_pickle('data/data_for_mvp.pickle').reset_index(drop=True)
+
+    data['journey_end_ts'] = pd.to_datetime(data['journey_end_ts']).dt.date
+    data = data[data['len_tw_source'] <= 15]
+    return prepare_data(data)
+
+
+MMM_PATH = 'data/final_final_mmm.csv'
+mmm_key = path_fingerprint(MMM_PATH)
+data_revenue = pd.read_csv(MMM_PATH)
+with stage('load'):
+    data_shop_1, data_shop_2 = cache.get_or_compute(load_key, load_data)
+models = ['fta', 'lta','linear', 'time-decay', 'position-based', 'markov', 'shapley']
+model_names = {'fta': 'First Touch Attribution',
+               'lta': 'Last Touch Attribution',
+               'linear': 'Linear Attribution',
+               'time-decay': 'Time Decay Attribution',
+               'position-based': 'Position Based Attribution',
+               'markov': 'Markov Attribution',
+               'shapley': 'Shapley Attribution'}
+
 # Display the selected dates
 st.write('Дата начала периода:', start_date)
 st.write('Дата конца периода:', end_date)
 
 selected_models = st.multiselect('Выберите модели атрибуции:', models)
+show_intervals = st.checkbox('Показать 95% доверительные интервалы (бутстрап)')
 
 
 
 # Plot based on selected data shop
 if selected_shop == 'beauty_shop_1':
-    data_shop = data_shop_1.copy()
+    history_shop = data_shop_1
 elif selected_shop == 'beauty_shop_2':
-    data_shop = data_shop_2.copy()
+    history_shop = data_shop_2
 
 
-fig_channels = fig_calculate_channels(data_shop)
-fig_prob = fig_purchase_prob(data_shop)
-data_shop = data_shop[(data_shop['journey_end_ts'] >= start_date) & (data_shop['journey_end_ts'] <= end_date)]
+with stage('history_plots', rows=len(history_shop)):
+    fig_channels = cache.get_or_compute((dataset_key, 'fig_channels', selected_shop), fig_calculate_channels, history_shop)
+    fig_prob = cache.get_or_compute((dataset_key, 'fig_prob', selected_shop), fig_purchase_prob, history_shop)
+data_shop = history_shop[(history_shop['journey_end_ts'] >= start_date) & (history_shop['journey_end_ts'] <= end_date)].copy()
 data_revenue = data_revenue[data_revenue['provider_account'] == selected_shop]
 data_revenue['spendings'] = data_revenue['facebook-ads'] + data_revenue['google-ads'] + data_revenue['pinterest-ads'] + data_revenue['snapchat-ads'] + data_revenue['tiktok-ads'] + data_revenue['amazon']
-all_channels, data_dic_timing = mean_channel_attribution_time(data_shop)
-mcat = mean_channel_attribution_time(data_shop)
+period_key = (dataset_key, selected_shop, start_date, end_date)
+# daily path counts of the shop's whole history, any date range is then a difference of two prefix sums
+with stage('cube', rows=len(history_shop)):
+    cube = cache.get_or_compute((dataset_key, 'cube', selected_shop), PathCube.from_journeys, history_shop, selected_shop)
+with stage('channel_timing', rows=len(data_shop)):
+    mcat = cache.get_or_compute(period_key + ('mcat',), mean_channel_attribution_time, data_shop)
+all_channels, data_dic_timing = mcat
 mean_time, mean_place, times = sorted_mean_channel_attribution_time(mcat)
 # attribution_results = {}
 all_channels = [data_shop['tw_source_clean'][i] for i in data_shop['tw_source_clean'].index]
@@ -105,71 +159,28 @@ data_to_download  = pd.DataFrame(index = all_channels)
 # Plot based on selected date range
 fig = go.Figure()
 fig_revenue = go.Figure()
-# first touch attribution
-if 'fta' in selected_models:   
-    fta= sort_attribution_result(first_touch_attribution(data_shop, selected_shop)).items()
-    data_to_download['fta'] = dict(fta)
-    fta_result = dict(itertools.islice(fta, selected_number))
-    fig.add_trace(go.Bar(x=list(fta_result.keys()), 
-                         y=list(fta_result.values()), 
-                         name=f'First Touch Attribution'))
-# last touch attribution
-if 'lta' in selected_models:
-    lta = sort_attribution_result(last_touch_attribution(data_shop, selected_shop)).items()
-    data_to_download['lta'] = dict(lta)
-    lta_result = dict(itertools.islice(lta, selected_number))
-    fig.add_trace(go.Bar(x=list(lta_result.keys()), 
-                         y=list(lta_result.values()), 
-                         name=f'Last Touch Attribution'))
-# linear attribution
-if 'linear' in selected_models:
-    linear = sort_attribution_result(first_touch_attribution(data_shop, selected_shop)).items()
-    data_to_download['linear'] = dict(linear)
-    linear_result = dict(itertools.islice(linear, selected_number))
-    fig.add_trace(go.Bar(x=list(linear_result.keys()), 
-                         y=list(linear_result.values()), 
-                         name=f'Linear Attribution'))
-# time decay attribution
-if 'time-decay' in selected_models:
-    time_decay = sort_attribution_result(time_decay_attribution(data_shop, selected_shop)).items()
-    data_to_download['time-decay'] = dict(time_decay)
-    time_decay_result = dict(itertools.islice(time_decay, selected_number))
-    fig.add_trace(go.Bar(x=list(time_decay_result.keys()), 
-                         y=list(time_decay_result.values()), 
-                         name=f'Time Decay Attribution'))
-# position based attribution
-if 'position-based' in selected_models:
-    position_based = sort_attribution_result(position_based_attribution(data_shop, selected_shop)).items()
-    data_to_download['position-based'] = dict(position_based)
-    position_based_result = dict(itertools.islice(position_based, selected_number))
-    fig.add_trace(go.Bar(x=list(position_based_result.keys()), 
-                         y=list(position_based_result.values()), 
-                         name=f'Position Based Attribution'))
-# markov attribution
-if 'markov' in selected_models:
-    mta_data_shop, budget = prep_data_for_markov_shapley(data_shop) # TODO: оптимизировать подсчет датасета
-    markov = markov_attribution(mta_data_shop, budget)
-    markov = sort_attribution_result(markov[0]['data']['conversion']).items()
-    data_to_download['markov'] = dict(markov)
-    markov = dict(itertools.islice(
-        markov, 
-        selected_number))
-    fig.add_trace(go.Bar(x=list(markov.keys()), 
-                         y=list(markov.values()), 
-                         name=f'Markov Attribution'))
-# shapley attribution
-if 'shapley' in selected_models:
-    mta_data_shop, budget = prep_data_for_markov_shapley(data_shop)
-    shapley = shapley_attribution(mta_data_shop, budget)
-    shapley = sort_attribution_result(shapley[0]['data']['conversion']).items()
-    data_to_download['shapley'] = dict(shapley)
-    shapley = dict(itertools.islice(
-        shapley, 
-        selected_number))
-    fig.add_trace(go.Bar(x=list(shapley.keys()), 
-                         y=list(shapley.values()), 
-                         name=f'Shapley Attribution'))
-    # st.write('Shapley Attribution:')
+# models not cached yet for this period are computed in one pass over the cube's range totals
+with stage('attribution', paths=len(cube.paths)):
+    attribution_results = attribute_cached(cache, period_key, selected_models, attribute_cube, cube, start_date, end_date)
+if show_intervals and selected_models:
+    # resampled path counts of the period, cached with the selected models
+    with stage('bootstrap', paths=len(cube.paths)):
+        intervals = cache.get_or_compute(period_key + ('bootstrap', tuple(sorted(selected_models))),
+                                         bootstrap_cube, cube, start_date, end_date, selected_models)
+for model in [m for m in models if m in selected_models]:
+    attribution = sort_attribution_result(attribution_results[model]).items()
+    data_to_download[model] = dict(attribution)
+    attribution = dict(itertools.islice(attribution, selected_number))
+    error_y = None
+    if show_intervals:
+        bounds = intervals[model].reindex(list(attribution.keys()))
+        error_y = dict(type='data', symmetric=False,
+                       array=(bounds['upper'] - bounds['estimate']).tolist(),
+                       arrayminus=(bounds['estimate'] - bounds['lower']).tolist())
+    fig.add_trace(go.Bar(x=list(attribution.keys()), 
+                         y=list(attribution.values()), 
+                         name=model_names[model],
+                         error_y=error_y))
 
 # Download the attribution results as a CSV file
 download_link = download_csv(np.round(data_to_download.fillna(0), 3), f'attribution_results_{selected_shop}_{start_date}_{end_date}.csv')
@@ -207,10 +218,47 @@ st.plotly_chart(fig_channels)
 st.plotly_chart(fig_prob)
 selected_revenue = st.selectbox('Показать результат MMM модели?', ['нет', 'да'])
 if selected_revenue == 'да':
-    lr, X, y = train_mmm_model(data_revenue.drop(columns='spendings'), selected_shop)
-    fig = draw_mmm_result(lr, X, y)
+    with stage('mmm', rows=len(data_revenue)):
+        # adstock and saturation fitted once per shop
+        mmm = cache.get_or_compute((mmm_key, 'mmm', selected_shop), MediaMixModel.fit, data_revenue, selected_shop)
+        fig = draw_mmm_result(mmm)
     st.plotly_chart(fig)
+
+    # budget scenarios on the fitted response curves, the engine and its optima cached with the model
+    engine = cache.get_or_compute((mmm_key, 'scenarios', selected_shop), ScenarioEngine, mmm)
+    baseline = engine.evaluate(np.eye(len(engine.channels)))[0]
+    st.subheader('Сценарии бюджета')
+    col1, col2 = st.columns(2)
+    source = col1.selectbox('Перенести бюджет из канала', engine.channels)
+    target = col2.selectbox('В канал', [c for c in engine.channels if c != source])
+    moved = st.slider('Доля бюджета канала, %', 0, 100, 20)
+    with stage('scenarios', scenarios=101):
+        # every share from 0 to 100% in one batch
+        shares = np.linspace(0, 1, 101)
+        revenue = engine.evaluate(engine.shift(source, target, shares))
+    st.write(f'Выручка при переносе {moved}% бюджета {source} в {target}: {revenue[moved]:,.0f} '
+             f'({revenue[moved] / baseline - 1:+.1%} к фактической)')
+    st.plotly_chart(px.line(x=shares * 100, y=revenue, title=f'Выручка при переносе бюджета {source} в {target}',
+                            labels={'x': 'Доля бюджета, %', 'y': 'Выручка'}))
+
+    col1, col2 = st.columns(2)
+    budget = col1.slider('Общий бюджет, % от фактического', 50, 200, 100, step=10)
+    max_share = col2.slider('Максимальная доля канала, %', 10, 100, 50, step=5)
+    with stage('optimize'):
+        optimal = engine.optimize(budget / 100, max_shares={c: max_share / 100 for c in engine.channels})
+    st.write(f"Оптимальное распределение: выручка {optimal.attrs['optimal_total']:,.0f} против "
+             f"{optimal.attrs['actual_total']:,.0f} при фактических долях каналов "
+             f"({optimal.attrs['optimal_total'] / optimal.attrs['actual_total'] - 1:+.1%})")
+    st.dataframe(optimal.style.format({'actual_share': '{:.1%}', 'optimal_share': '{:.1%}',
+                                       'actual_revenue': '{:,.0f}', 'optimal_revenue': '{:,.0f}'}))
     pass
 else:
     st.plotly_chart(fig_revenue)
-st.plotly_chart(fig_mean_path)
\ No newline at end of file
+st.plotly_chart(fig_mean_path)
+
+if debug:
+    profile.stop()
+    with st.sidebar.expander('Профилирование', expanded=True):
+        st.write(f'Всего: {profile.seconds:.3f} с, кэш: {cache.hits} попаданий, {cache.misses} промахов')
+        st.dataframe(profile.to_frame())
+        st.json(profile.report(), expanded=False)
@@ -2,19 +2,392 @@
 import pandas as pd
 import numpy as np
 from collections import defaultdict, Counter
-from functools import reduce, wraps
-from itertools import chain, tee, combinations
-from operator import mul
+from functools import wraps
+from itertools import chain, tee
 
 # Type hinting and utilities
 from typing import List, Any, Dict, Tuple, DefaultDict
 
-# Date and time management
-import arrow
-
 # Utility modules for deep copying and other operations
 import copy
 
+from utils.profiling import timed
+
+# size reported with the timed models: distinct paths they run on
+_paths = lambda self, *args, **kwargs: len(self.journeys)
+
+
+def transition_probabilities(counts: np.ndarray) -> np.ndarray:
+
+    """
+    turn a square matrix of transition counts into a row-stochastic transition matrix;
+    rows without any outgoing transitions (absorbing states) are left as zeros. Leading dimensions
+    are batch dimensions
+    """
+
+    outs = counts.sum(axis=-1, keepdims=True)
+
+    return np.divide(counts, outs, out=np.zeros_like(counts, dtype=float), where=outs > 0)
+
+
+def absorbing_removal_probabilities(
+    trans: np.ndarray, start_idx: int, conv_idx: int, null_idx: int
+) -> Tuple[float, np.ndarray]:
+
+    """
+    solve the absorbing chain given by the transition matrix trans and return
+
+        - the probability to reach conv_idx when starting from start_idx
+        - an array with the same probability after each state has been removed from the graph,
+          i.e. every transition into that state ends up in null_idx instead; the array is indexed
+          like trans, entries for start_idx and the absorbing states are nan
+
+    with Q the transient block, N = (I - Q)^-1 the fundamental matrix and x = N r the conversion
+    probabilities, removing state c zeroes column c of Q which is a rank one update of I - Q, so by
+    Sherman-Morrison the conversion probability from the start becomes x_s - N[s, c] * x_c / N[c, c]
+    and all removals come out of a single matrix inversion
+
+    trans may be a stack of chains (leading batch dimensions, e.g. bootstrap replicates); they are
+    solved in one batched inversion and the probabilities come back with the same leading dimensions
+    """
+
+    n = trans.shape[-1]
+    transient = np.array([i for i in range(n) if i not in (conv_idx, null_idx)])
+    s = int(np.flatnonzero(transient == start_idx)[0])
+
+    q = trans[..., transient[:, None], transient]
+    r = trans[..., transient, conv_idx]
+
+    fundamental = np.linalg.inv(np.eye(len(transient)) - q)
+    x = (fundamental @ r[..., None])[..., 0]
+
+    p_removed = np.full(trans.shape[:-1], np.nan)
+    p_removed[..., transient] = (
+        x[..., s, None] - fundamental[..., s, :] * x / np.diagonal(fundamental, axis1=-2, axis2=-1)
+    )
+    p_removed[..., start_idx] = np.nan
+
+    if trans.ndim == 2:
+        return float(x[s]), p_removed
+
+    return x[..., s], p_removed
+
+
+def simulate_absorption(
+    trans: np.ndarray,
+    start_idx: int,
+    conv_idx: int,
+    n: int,
+    rng: np.random.Generator,
+    tol: float = None,
+    batch_size: int = int(1e5),
+    max_steps: int = 1000,
+) -> Tuple[int, int]:
+
+    """
+    walk random users from start_idx through the transition matrix trans until they reach a state
+    without outgoing transitions; walkers move batch_size at a time as an integer array of states and
+    every step is a single searchsorted over the row-wise cumulative probabilities shifted by the row
+    index. Stops after n walks or as soon as the standard error of the conversion rate is below tol;
+    walkers still moving after max_steps count as lost. Returns (conversions, walks)
+    """
+
+    n_states = trans.shape[0]
+    cum = np.cumsum(trans, axis=1)
+    totals = cum[:, -1:]
+    cum = np.divide(cum, totals, out=np.zeros_like(cum), where=totals > 0)
+    absorbing = totals[:, 0] == 0
+    # row i lives in [i, i + 1] so that one sorted array serves every state
+    flat_cum = (cum + np.arange(n_states)[:, None]).ravel()
+
+    convs = walks = 0
+
+    while walks < n:
+
+        state = np.full(min(batch_size, n - walks), start_idx)
+        walks += len(state)
+
+        for _ in range(max_steps):
+
+            nxt = np.searchsorted(flat_cum, state + rng.random(len(state)), side="right")
+            state = nxt - state * n_states
+
+            done = absorbing[state]
+            convs += int(np.count_nonzero(state[done] == conv_idx))
+            state = state[~done]
+
+            if not len(state):
+                break
+
+        if tol is not None:
+            p = convs / walks
+            if np.sqrt(p * (1 - p) / walks) < tol:
+                break
+
+    return convs, walks
+
+
+def shapley_path_weights(lengths: np.ndarray, max_subset_size: int = 3) -> np.ndarray:
+
+    """
+    share of a path's conversions that goes to each of its distinct channels under the Shapley model,
+    for paths with lengths distinct channels
+
+    a path with channel set S adds its conversions once for every subset T of the coalition with
+    T within S and 1 <= |T| <= max_subset_size, i.e. g(|A & S|) = sum_j C(|A & S|, j) times; that game
+    is symmetric in the channels of S and blind to all others, so each of them gets g(|S|) / |S|
+    """
+
+    lengths = np.asarray(lengths, dtype=float)
+    subsets = np.zeros(len(lengths))
+    binomial = np.ones(len(lengths))
+
+    for j in range(1, max_subset_size + 1):
+        binomial = binomial * (lengths - j + 1) / j
+        subsets += binomial
+
+    return np.divide(subsets, lengths, out=np.zeros(len(lengths)), where=lengths > 0)
+
+
+def shapley_values(
+    members: np.ndarray,
+    offsets: np.ndarray,
+    conversions: np.ndarray,
+    n_players: int,
+    max_subset_size: int = 3,
+) -> np.ndarray:
+
+    """
+    exact Shapley values of the game where the worth of a coalition A is the total number of
+    conversions generated by all subsets of A with at most max_subset_size channels, a subset T
+    generating the conversions of every path that visits all of T; members[offsets[k]:offsets[k + 1]]
+    are the distinct players on path k
+
+    the worth is a sum of one symmetric game per path, so the values come out in O(touches) for any
+    number of players (see shapley_path_weights)
+    """
+
+    lengths = np.diff(offsets)
+    share = conversions * shapley_path_weights(lengths, max_subset_size)
+
+    return np.bincount(members, weights=np.repeat(share, lengths), minlength=n_players)
+
+
+class JourneyStore:
+
+    """
+    integer-coded aggregated journeys in CSR form: the touches of path k are
+    channels[offsets[k]:offsets[k + 1]] (channel ids index into channel_names) and conversions, values
+    and nulls hold total_conversions, total_conversion_value and total_null of every path
+    """
+
+    def __init__(
+        self,
+        channels: np.ndarray,
+        offsets: np.ndarray,
+        conversions: np.ndarray,
+        values: np.ndarray,
+        nulls: np.ndarray,
+        channel_names: List[str],
+        exposure: np.ndarray = None,
+    ) -> None:
+
+        self.channels = channels
+        self.offsets = offsets
+        self.conversions = conversions
+        self.values = values
+        self.nulls = nulls
+        self.channel_names = channel_names
+        # exposure time of every touch in seconds, if known
+        self.exposure = exposure
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, sep: str = ">") -> "JourneyStore":
+
+        """
+        build the store from aggregated data with sep-joined channel names in the path column;
+        channel ids follow the sorted channel names. Exposure times given in the same form are
+        turned into seconds
+        """
+
+        data = data.reset_index(drop=True)
+        touches = data["path"].str.split(sep).explode().str.strip()
+        codes, channel_names = pd.factorize(touches, sort=True)
+        lengths = np.bincount(touches.index, minlength=len(data))
+
+        exposure = None
+        if "exposure_times" in data.columns:
+            exposure = (
+                pd.to_datetime(data["exposure_times"].str.split(sep).explode().str.strip())
+                .astype("int64")
+                .to_numpy()
+                / 1e9
+            )
+
+        return cls(
+            channels=codes.astype(np.int32),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            conversions=data["total_conversions"].to_numpy(dtype=float),
+            values=data["total_conversion_value"].to_numpy(dtype=float)
+            if "total_conversion_value" in data.columns
+            else np.zeros(len(data)),
+            nulls=data["total_null"].to_numpy(dtype=float),
+            channel_names=list(channel_names),
+            exposure=exposure,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+
+        """
+        aggregated data with lists of channel names in the path column
+        """
+
+        names = np.asarray(self.channel_names, dtype=object)
+
+        return pd.DataFrame(
+            {
+                "path": [list(p) for p in np.split(names[self.channels], self.offsets[1:-1])],
+                "total_conversions": self.conversions,
+                "total_conversion_value": self.values,
+                "total_null": self.nulls,
+            }
+        )
+
+    def collapse_loops(self, merge: bool = True) -> "JourneyStore":
+
+        """
+        drop touches repeating the channel right before them on the same path (a > a > b becomes a > b)
+        and merge the paths that become identical; merged paths keep the position of, and the exposure
+        times from, their first occurrence. With merge=False every path keeps its row
+        """
+
+        keep = np.ones(len(self.channels), dtype=bool)
+        keep[1:] = self.channels[1:] != self.channels[:-1]
+        keep[self.offsets[:-1]] = True
+
+        channels = self.channels[keep]
+        path_index = self.path_index[keep]
+        lengths = np.bincount(path_index, minlength=len(self))
+
+        if not merge:
+            return JourneyStore(
+                channels=channels,
+                offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                conversions=self.conversions,
+                values=self.values,
+                nulls=self.nulls,
+                channel_names=self.channel_names,
+                exposure=None if self.exposure is None else self.exposure[keep],
+            )
+
+        starts = np.cumsum(lengths) - lengths
+        position = np.arange(len(channels)) - starts[path_index]
+
+        # identical paths share their length and a polynomial hash of their channels (mod 2^64, summed
+        # over the CSR arrays); every path is then checked against the first path of its group, and a
+        # collision, should one ever happen, is resolved by hashing again with another base
+        for base in (1000003, 998244353, 1000000007, 2147483647):
+            powers = np.cumprod(np.full(lengths.max(initial=0), base, dtype=np.uint64))
+            terms = (channels.astype(np.uint64) + np.uint64(1)) * powers[position]
+            summed = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(terms, dtype=np.uint64)])
+            hashes = summed[np.cumsum(lengths)] - summed[starts]
+            _, first, inverse = np.unique(
+                np.stack([lengths.astype(np.int64), hashes.view(np.int64)], axis=1),
+                axis=0,
+                return_index=True,
+                return_inverse=True,
+            )
+            inverse = inverse.reshape(-1)
+            if np.array_equal(channels, channels[starts[first[inverse]][path_index] + position]):
+                break
+        else:
+            raise RuntimeError("could not tell the collapsed paths apart by their hashes")
+
+        order = np.argsort(first)
+        group = np.empty_like(order)
+        group[order] = np.arange(len(order))
+        group = group[inverse]
+
+        representative = np.zeros(len(self), dtype=bool)
+        representative[first] = True
+        touches = representative[path_index]
+
+        merge = lambda a: np.bincount(group, weights=a, minlength=len(first))
+
+        return JourneyStore(
+            channels=channels[touches],
+            offsets=np.concatenate([[0], np.cumsum(lengths[first[order]])]).astype(np.int64),
+            conversions=merge(self.conversions),
+            values=merge(self.values),
+            nulls=merge(self.nulls),
+            channel_names=self.channel_names,
+            exposure=None if self.exposure is None else self.exposure[keep][touches],
+        )
+
+    def __len__(self) -> int:
+
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+
+        return np.diff(self.offsets)
+
+    @property
+    def path_index(self) -> np.ndarray:
+
+        """
+        the path every touch belongs to
+        """
+
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    @property
+    def first(self) -> np.ndarray:
+
+        return self.channels[self.offsets[:-1]]
+
+    @property
+    def last(self) -> np.ndarray:
+
+        return self.channels[self.offsets[1:] - 1]
+
+    def paths(self):
+
+        """
+        iterate over the paths as arrays of channel ids
+        """
+
+        return np.split(self.channels, self.offsets[1:-1])
+
+    def first_appearances(self, reverse: bool = False) -> np.ndarray:
+
+        """
+        sorted positions of the touches where a channel shows up on its path for the first time
+        (for the last time if reverse is True)
+        """
+
+        key = self.path_index.astype(np.int64) * len(self.channel_names) + self.channels
+
+        if reverse:
+            return np.sort(len(key) - 1 - np.unique(key[::-1], return_index=True)[1])
+
+        return np.sort(np.unique(key, return_index=True)[1])
+
+    def distinct(self) -> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        the distinct channels of every path in order of first appearance, again as (channels, offsets)
+        """
+
+        first_seen = self.first_appearances()
+
+        return (
+            self.channels[first_seen],
+            np.concatenate(
+                [[0], np.cumsum(np.bincount(self.path_index[first_seen], minlength=len(self)))]
+            ).astype(np.int64),
+        )
 
 
 class MTA:
@@ -26,35 +399,32 @@ class MTA:
         sep: str = " > ",
     ) -> None:
 
-        self.data = data
         self.sep = sep
         self.NULL = "(null)"
         self.START = "(start)"
         self.CONV = "(conversion)"
 
         if not (
-            set(self.data.columns)
+            set(data.columns)
             <= set(
                 "path total_conversions total_conversion_value total_null exposure_times".split()
             )
         ):
             raise ValueError(f"wrong column names in {data}!")
 
+        # integer-coded copy of the paths every model works with
+        self.journeys = JourneyStore.from_frame(data, sep=self.sep.strip())
+        # (journeys, frame) once self.data has been asked for
+        self._data: Tuple[JourneyStore, pd.DataFrame] = (None, None)
+
         if add_timepoints:
             self.add_exposure_times(1)
 
         if not allow_loops:
             self.remove_loops()
 
-        # we'll work with lists in path and exposure_times from now on
-        self.data[["path", "exposure_times"]] = self.data[
-            ["path", "exposure_times"]
-        ].applymap(lambda _: [ch.strip() for ch in _.split(self.sep.strip())])
-
         # make a sorted list of channel names
-        self.channels = sorted(
-            list({ch for ch in chain.from_iterable(self.data["path"])})
-        )
+        self.channels = self.journeys.channel_names
         # add some extra channels
         self.channels_ext = [self.START] + self.channels + [self.CONV, self.NULL]
         # make dictionary mapping a channel name to it's index
@@ -78,105 +448,71 @@ class MTA:
 
         return f'{self.__class__.__name__} with {len(self.channels)} channels: {", ".join(self.channels)}'
 
+    def channel_credit(
+        self, credit: np.ndarray, keep: np.ndarray = None
+    ) -> DefaultDict[str, float]:
+
+        """
+        map an array of credit per channel id back to channel names; keep optionally masks the channels to report
+        """
+
+        return defaultdict(
+            float,
+            (
+                (c, credit[i])
+                for i, c in enumerate(self.channels)
+                if keep is None or keep[i]
+            ),
+        )
+
+    def converting_channels(self) -> np.ndarray:
+
+        """
+        mask of the channels that appear on at least one path with conversions
+        """
+
+        keep = np.zeros(len(self.channels), dtype=bool)
+        keep[self.journeys.channels[self.journeys.conversions[self.journeys.path_index] > 0]] = True
+
+        return keep
+
     def add_exposure_times(self, exposure_every_second: bool = True) -> "MTA":
 
         """
         generate synthetic exposure times; if exposure_every_second is True, the exposures will be
         1 sec away from one another, otherwise we'll generate time spans randomly
 
-        - the times are of the form 2018-11-26T03:54:26.532091+00:00
+        - the times are offsets in seconds from the first touch of the path
         """
 
-        if "exposure_times" in self.data.columns:
+        j = self.journeys
+
+        if j.exposure is not None:
             return self
 
-        ts = []  # this will be a list of time instant lists one per path
+        position = np.arange(len(j.channels)) - j.offsets[:-1][j.path_index]
 
         if exposure_every_second:
-
-            _t0 = arrow.utcnow()
-
-            self.data["path"].str.split(">").apply(
-                lambda _: [ch.strip() for ch in _]
-            ).apply(
-                lambda lst: ts.append(
-                    self.sep.join(
-                        [
-                            r.format("YYYY-MM-DD HH:mm:ss")
-                            for r in arrow.Arrow.range(
-                                "second", _t0, _t0.shift(seconds=+(len(lst) - 1))
-                            )
-                        ]
-                    )
-                )
-            )
-
-        self.data["exposure_times"] = ts
+            j.exposure = position.astype(float)
+        else:
+            steps = np.random.default_rng().exponential(1.0, len(position))
+            steps[j.offsets[:-1]] = 0
+            j.exposure = np.cumsum(steps) - np.repeat(np.cumsum(steps)[j.offsets[:-1]], j.lengths)
 
         return self
 
-    # @show_time
+    @timed(paths=_paths)
     def remove_loops(self) -> "MTA":
 
         """
         remove transitions from a channel directly to itself, e.g. a > a
         """
 
-        cpath = []
-        cexposure = []
-
-        self.data[["path", "exposure_times"]] = self.data[
-            ["path", "exposure_times"]
-        ].applymap(lambda _: [ch.strip() for ch in _.split(">")])
-
-        for row in self.data.itertuples():
-
-            clean_path = []
-            clean_exposure_times = []
-
-            for i, p in enumerate(row.path, 1):
-
-                if i == 1:
-                    clean_path.append(p)
-                    clean_exposure_times.append(row.exposure_times[i - 1])
-                else:
-                    if p != clean_path[-1]:
-                        clean_path.append(p)
-                        clean_exposure_times.append(row.exposure_times[i - 1])
-
-            cpath.append(self.sep.join(clean_path))
-            cexposure.append(self.sep.join(clean_exposure_times))
-
-        self.data_ = pd.concat(
-            [
-                pd.DataFrame({"path": cpath}),
-                self.data[
-                    [
-                        c
-                        for c in self.data.columns
-                        if c not in "path exposure_times".split()
-                    ]
-                ],
-                pd.DataFrame({"exposure_times": cexposure}),
-            ],
-            axis=1,
-        )
-
-        _ = (
-            self.data_[[c for c in self.data.columns if c != "exposure_times"]]
-            .groupby("path")
-            .sum()
-            .reset_index()
-        )
-
-        self.data = _.join(
-            self.data_[["path", "exposure_times"]].set_index("path"),
-            on="path",
-            how="inner",
-        ).drop_duplicates(["path"])
+        self.journeys = self.journeys.collapse_loops()
 
         return self
 
+    @timed(paths=_paths)
     def linear(self, share: str = "same", normalize: bool = True) -> "MTA":
 
         """
@@ -193,40 +529,29 @@ class MTA:
         if share not in "same proportional".split():
             raise ValueError("share parameter must be either *same* or *proportional*!")
 
-        self.linear = defaultdict(float)
-
-        for row in self.data.itertuples():
-
-            if row.total_conversions:
-
-                if share == "same":
-
-                    n = len(
-                        set(row.path)
-                    )  # number of unique channels visited during the journey
-                    s = (
-                        row.total_conversions / n
-                    )  # each channel is getting an equal share of conversions
+        j = self.journeys
 
-                    for c in set(row.path):
-                        self.linear[c] += s
+        if share == "same":
 
-                elif share == "proportional":
-
-                    c_counts = Counter(
-                        row.path
-                    )  # count how many times channels appear on this path
-                    tot_appearances = sum(c_counts.values())
-
-                    c_shares = defaultdict(float)
-
-                    for c in c_counts:
+            # each unique channel visited during the journey gets an equal share of conversions
+            visited = j.first_appearances()
+            n_unique = np.bincount(j.path_index[visited], minlength=len(j))
+            credit = np.bincount(
+                j.channels[visited],
+                weights=(j.conversions / n_unique)[j.path_index[visited]],
+                minlength=len(self.channels),
+            )
 
-                        c_shares[c] = c_counts[c] / tot_appearances
+        elif share == "proportional":
 
-                    for c in set(row.path):
+            # every appearance of a channel on the path gets an equal share
+            credit = np.bincount(
+                j.channels,
+                weights=(j.conversions / j.lengths)[j.path_index],
+                minlength=len(self.channels),
+            )
 
-                        self.linear[c] += row.total_conversions * c_shares[c]
+        self.linear = self.channel_credit(credit, self.converting_channels())
 
         # if normalize:
         #     self.linear = self.normalize_dict(self.linear)
@@ -235,7 +560,7 @@ class MTA:
 
         return self
 
-    # @show_time
+    @timed(paths=_paths)
     def position_based(
         self, r: Tuple[float, float] = (40, 40), normalize: bool = True
     ) -> "MTA":
@@ -244,32 +569,33 @@ class MTA:
         give 40% credit to the first and last channels and divide the rest equally across the remaining channels
         """
 
-        self.position_based = defaultdict(float)
-
-        for row in self.data.itertuples():
+        j = self.journeys
+        convs = j.conversions
+        n = np.bincount(j.path_index[j.first_appearances()], minlength=len(j))
 
-            if row.total_conversions:
-
-                n = len(set(row.path))
+        # one channel gets everything, two split equally, otherwise r[0] and r[1] percent go to
+        # the first and last touch and the rest is divided over the touches in between
+        first_share = np.where(n == 1, 0, np.where(n == 2, convs / 2, r[0] * convs / 100))
+        last_share = np.where(n == 1, convs, np.where(n == 2, convs / 2, r[1] * convs / 100))
+        middle_share = np.where(
+            n > 2, (100 - sum(r)) * convs / np.maximum(n - 2, 1) / 100, 0
+        )
 
-                if n == 1:
-                    self.position_based[row.path[-1]] += row.total_conversions
-                elif n == 2:
-                    equal_share = row.total_conversions / n
-                    self.position_based[row.path[0]] += equal_share
-                    self.position_based[row.path[-1]] += equal_share
-                else:
-                    self.position_based[row.path[0]] += (
-                        r[0] * row.total_conversions / 100
-                    )
-                    self.position_based[row.path[-1]] += (
-                        r[1] * row.total_conversions / 100
-                    )
+        middle = np.ones(len(j.channels), dtype=bool)
+        middle[j.offsets[:-1]] = False
+        middle[j.offsets[1:] - 1] = False
+
+        credit = (
+            np.bincount(j.first, weights=first_share, minlength=len(self.channels))
+            + np.bincount(j.last, weights=last_share, minlength=len(self.channels))
+            + np.bincount(
+                j.channels[middle],
+                weights=middle_share[j.path_index[middle]],
+                minlength=len(self.channels),
+            )
+        )
 
-                    for c in row.path[1:-1]:
-                        self.position_based[c] += (
-                            (100 - sum(r)) * row.total_conversions / (n - 2) / 100
-                        )
+        self.position_based = self.channel_credit(credit, self.converting_channels())
 
         # if normalize:
         #     self.position_based = self.normalize_dict(self.position_based)
@@ -278,7 +604,7 @@ class MTA:
 
         return self
 
-    # @show_time
+    @timed(paths=_paths)
     def time_decay(
         self, count_direction: str = "left", normalize: bool = True
     ) -> "MTA":
@@ -295,32 +621,27 @@ class MTA:
 
         """
 
-        self.time_decay = defaultdict(float)
-
         if count_direction not in "left right".split():
             raise ValueError("argument count_direction must be *left* or *right*!")
 
-        for row in self.data.itertuples():
-
-            if row.total_conversions:
+        j = self.journeys
 
-                channels_by_exp_time = []
+        # channels ordered by their first exposure (left) or by their last exposure (right)
+        seen = j.first_appearances(reverse=count_direction == "right")
+        seen_path = j.path_index[seen]
+        n = np.bincount(seen_path, minlength=len(j))
 
-                _ = row.path if count_direction == "left" else row.path[::-1]
+        # first channel gets 1, second 2, etc.
+        rank = np.arange(1, len(seen) + 1) - np.concatenate([[0], np.cumsum(n)[:-1]])[seen_path]
+        score_unit = 1.0 / (n * (n + 1) / 2)
 
-                for c in _:
-                    if c not in channels_by_exp_time:
-                        channels_by_exp_time.append(c)
-
-                if count_direction == "right":
-                    channels_by_exp_time = channels_by_exp_time[::-1]
-
-                # first channel gets 1, second 2, etc.
-
-                score_unit = 1.0 / sum(range(1, len(channels_by_exp_time) + 1))
+        credit = np.bincount(
+            j.channels[seen],
+            weights=rank * score_unit[seen_path] * j.conversions[seen_path],
+            minlength=len(self.channels),
+        )
 
-                for i, c in enumerate(channels_by_exp_time, 1):
-                    self.time_decay[c] += i * score_unit * row.total_conversions
+        self.time_decay = self.channel_credit(credit, self.converting_channels())
 
         # if normalize:
         #     self.time_decay = self.normalize_dict(self.time_decay)
@@ -329,17 +650,17 @@ class MTA:
 
         return self
 
-    # @show_time
+    @timed(paths=_paths)
     def first_touch(self, normalize: bool = True) -> "MTA":
 
-        first_touch = defaultdict(int)
-
-        for c in self.channels:
-
-            # total conversions for all paths where the first channel was c
-            first_touch[c] = self.data.loc[
-                self.data["path"].apply(lambda _: _[0] == c), "total_conversions"
-            ].sum()
+        # total conversions for all paths where the first channel was c
+        first_touch = self.channel_credit(
+            np.bincount(
+                self.journeys.first,
+                weights=self.journeys.conversions,
+                minlength=len(self.channels),
+            )
+        )
 
         # if normalize:
         #     first_touch = self.normalize_dict(first_touch)
@@ -348,17 +669,17 @@ class MTA:
 
         return self
 
-    # @show_time
+    @timed(paths=_paths)
     def last_touch(self, normalize: bool = True) -> "MTA":
 
-        last_touch = defaultdict(int)
-
-        for c in self.channels:
-
-            # total conversions for all paths where the last channel was c
-            last_touch[c] = self.data.loc[
-                self.data["path"].apply(lambda _: _[-1] == c), "total_conversions"
-            ].sum()
+        # total conversions for all paths where the last channel was c
+        last_touch = self.channel_credit(
+            np.bincount(
+                self.journeys.last,
+                weights=self.journeys.conversions,
+                minlength=len(self.channels),
+            )
+        )
 
         # if normalize:
         #     last_touch = self.normalize_dict(last_touch)
@@ -382,13 +703,10 @@ class MTA:
 
         c = defaultdict(int)
 
-        for row in self.data.itertuples():
+        counts = self.transition_counts()
 
-            for ch_pair in self.pairs([self.START] + row.path):
-                c[ch_pair] += row.total_conversions + row.total_null
-
-            c[(row.path[-1], self.NULL)] += row.total_null
-            c[(row.path[-1], self.CONV)] += row.total_conversions
+        for i, j in zip(*np.nonzero(counts)):
+            c[(self.index_to_channel_name[i], self.index_to_channel_name[j])] = counts[i, j]
 
         return c
 
@@ -428,109 +746,153 @@ class MTA:
 
         return tr
 
-    # @show_time
-    def simulate_path(
-        self, trans_mat: Dict[Any, Any], drop_channel: bool = None, n: float = int(1e6)
-    ) -> DefaultDict[str, float]:
+    def transition_counts(self) -> np.ndarray:
 
         """
-        generate n random user journeys and see where these users end up - converted or not;
-        drop_channel is a channel to exclude from journeys if specified
+        the same pair counts transition_matrix is built from but as a square array indexed by
+        channel_name_to_index, i.e. T[i, j] is the number of moves from channel i to channel j
         """
 
-        outcome_counts = defaultdict(int)
+        j = self.journeys
+        n = len(self.channels_ext)
 
-        idx0 = self.channel_name_to_index[self.START]
-        null_idx = self.channel_name_to_index[self.NULL]
-        conv_idx = self.channel_name_to_index[self.CONV]
+        # store channel ids are shifted by one in channels_ext because of (start)
+        touch = j.channels.astype(np.int64) + 1
+        first, last = j.offsets[:-1], j.offsets[1:] - 1
+        # touches followed by another touch on the same path
+        inner = np.ones(len(touch), dtype=bool)
+        inner[last] = False
+        journeys = j.conversions + j.nulls
 
-        drop_idx = (
-            self.channel_name_to_index[drop_channel] if drop_channel else null_idx
+        src = np.concatenate(
+            [np.full(len(j), self.channel_name_to_index[self.START]), touch[inner], touch[last], touch[last]]
+        )
+        dst = np.concatenate(
+            [
+                touch[first],
+                touch[np.flatnonzero(inner) + 1],
+                np.full(len(j), self.channel_name_to_index[self.CONV]),
+                np.full(len(j), self.channel_name_to_index[self.NULL]),
+            ]
+        )
+        weights = np.concatenate(
+            [journeys, journeys[j.path_index[inner]], j.conversions, j.nulls]
         )
 
-        for _ in range(n):
-
-            stop_flag = None
-
-            while not stop_flag:
-
-                probs = [
-                    trans_mat.get(
-                        (
-                            self.index_to_channel_name[idx0],
-                            self.index_to_channel_name[i],
-                        ),
-                        0,
-                    )
-                    for i in range(len(self.channels_ext))
-                ]
-
-                # index of the channel where user goes next
-                idx1 = np.random.choice(
-                    [self.channel_name_to_index[c] for c in self.channels_ext],
-                    p=probs,
-                    replace=False,
-                )
-
-                if idx1 == conv_idx:
-                    outcome_counts[self.CONV] += 1
-                    stop_flag = True
-                elif idx1 in {null_idx, drop_idx}:
-                    outcome_counts[self.NULL] += 1
-                    stop_flag = True
-                else:
-                    idx0 = idx1
-
-        return outcome_counts
+        return np.bincount(src * n + dst, weights=weights, minlength=n * n).reshape(n, n)
 
-    def prob_convert(self, trans_mat, drop=None) -> float:
+    @timed(paths=_paths)
+    def simulate_path(
+        self,
+        trans_mat: Any,
+        drop_channel: str = None,
+        n: int = int(1e6),
+        rng: Any = None,
+        tol: float = None,
+        batch_size: int = int(1e5),
+    ) -> DefaultDict[str, float]:
 
-        _d = self.data[
-            self.data["path"].apply(lambda x: drop not in x)
-            & (self.data["total_conversions"] > 0)
-        ]
+        """
+        generate n random user journeys and see where these users end up - converted or not;
+        drop_channel is a channel to exclude from journeys if specified
 
-        p = 0
+        trans_mat is either the dictionary returned by transition_matrix or an array indexed by
+        channel_name_to_index; walkers are advanced batch_size at a time and the simulation stops early
+        once the standard error of the conversion rate falls below tol; rng is a np.random.Generator
+        or a seed
+        """
 
-        for row in _d.itertuples():
+        if isinstance(trans_mat, dict):
+            _trans = np.zeros((len(self.channels_ext), len(self.channels_ext)))
+            for (a, b), p in trans_mat.items():
+                _trans[self.channel_name_to_index[a], self.channel_name_to_index[b]] = p
+            trans_mat = _trans
 
-            probability_for_this_path = []
+        null_idx = self.channel_name_to_index[self.NULL]
 
-            for t in self.pairs([self.START] + row.path + [self.CONV]):
+        if drop_channel:
+            # journeys going to the dropped channel end there without a conversion
+            drop_idx = self.channel_name_to_index[drop_channel]
+            trans_mat = trans_mat.copy()
+            trans_mat[:, null_idx] += trans_mat[:, drop_idx]
+            trans_mat[:, drop_idx] = 0
+
+        convs, walks = simulate_absorption(
+            trans_mat,
+            start_idx=self.channel_name_to_index[self.START],
+            conv_idx=self.channel_name_to_index[self.CONV],
+            n=n,
+            rng=np.random.default_rng(rng),
+            tol=tol,
+            batch_size=batch_size,
+        )
 
-                probability_for_this_path.append(trans_mat.get(t, 0))
+        outcome_counts = defaultdict(int)
+        outcome_counts[self.CONV] = convs
+        outcome_counts[self.NULL] = walks - convs
 
-            p += reduce(mul, probability_for_this_path)
+        return outcome_counts
 
-        return p
+    @timed(paths=_paths)
+    def markov(
+        self,
+        sim: bool = False,
+        normalize: bool = True,
+        n_walks: int = int(1e6),
+        tol: float = None,
+        rng: Any = None,
+    ) -> "MTA":
 
-    # @show_time
-    def markov(self, sim: bool = False, normalize: bool = True) -> "MTA":
+        """
+        removal effects; with sim=False conversion probabilities are obtained by solving the absorbing
+        Markov chain (all channel removals at once), otherwise by simulating n_walks random user journeys
+        per graph (see simulate_path for tol and rng)
+        """
 
         markov = defaultdict(float)
 
-        # calculate the transition matrix
-        tr = self.transition_matrix()
-
         if not sim:
 
-            p_conv = self.prob_convert(trans_mat=tr)
+            p_conv, p_removed = absorbing_removal_probabilities(
+                transition_probabilities(self.transition_counts()),
+                start_idx=self.channel_name_to_index[self.START],
+                conv_idx=self.channel_name_to_index[self.CONV],
+                null_idx=self.channel_name_to_index[self.NULL],
+            )
+
+            if not p_conv:
+                raise ZeroDivisionError("conversion probability is zero, removal effects are undefined")
 
             for c in self.channels:
-                markov[c] = (p_conv - self.prob_convert(trans_mat=tr, drop=c)) / p_conv
+                markov[c] = (p_conv - p_removed[self.channel_name_to_index[c]]) / p_conv
+                self.removal_effects[c] = markov[c]
         else:
 
+            # calculate the transition matrix
+            tr = transition_probabilities(self.transition_counts())
+
+            # every simulation replays the same random numbers so that the differences between
+            # the full graph and the graph without a channel are not swamped by sampling noise
+            seed = int(np.random.default_rng(rng).integers(2**63))
+
+            # with tol set the simulations may stop after different numbers of walks, so compare rates
+            rate = lambda o: o[self.CONV] / (o[self.CONV] + o[self.NULL])
+
             outcomes = defaultdict(lambda: defaultdict(float))
             # get conversion counts when all channels are in place
-            outcomes["full"] = self.simulate_path(trans_mat=tr, drop_channel=None)
+            outcomes["full"] = self.simulate_path(
+                trans_mat=tr, drop_channel=None, n=n_walks, rng=seed, tol=tol
+            )
 
             for c in self.channels:
 
-                outcomes[c] = self.simulate_path(trans_mat=tr, drop_channel=c)
+                outcomes[c] = self.simulate_path(
+                    trans_mat=tr, drop_channel=c, n=n_walks, rng=seed, tol=tol
+                )
                 # removal effect for channel c
                 markov[c] = (
-                    outcomes["full"][self.CONV] - outcomes[c][self.CONV]
-                ) / outcomes["full"][self.CONV]
+                    rate(outcomes["full"]) - rate(outcomes[c])
+                ) / rate(outcomes["full"])
 
         # if normalize:
         #     markov = self.normalize_dict(markov)
@@ -539,71 +901,25 @@ class MTA:
 
         return self
 
-    def get_generated_conversions(self, max_subset_size: float = 3) -> "MTA":
-
-        self.cc = defaultdict(lambda: defaultdict(float))
-
-        for ch_list, convs, nulls in zip(
-            self.data["path"], self.data["total_conversions"], self.data["total_null"]
-        ):
-
-            # only look at journeys with conversions
-            for n in range(1, max_subset_size + 1):
-
-                for tup in combinations(set(ch_list), n):
-
-                    tup_ = self.ordered_tuple(tup)
-
-                    self.cc[tup_][self.CONV] += convs
-                    self.cc[tup_][self.NULL] += nulls
-
-        return self
-
-    def v(self, coalition: Tuple[Any, Any]) -> float:
-
-        """
-        total number of conversions generated by all subsets of the coalition;
-        coalition is a tuple of channels
-        """
-
-        s = len(coalition)
-
-        total_convs = 0
-
-        for n in range(1, s + 1):
-            for tup in combinations(coalition, n):
-                tup_ = self.ordered_tuple(tup)
-                total_convs += self.cc[tup_][self.CONV]
-
-        return total_convs
-
-    def w(self, s, n):
-
-        return (
-            np.math.factorial(s) * (np.math.factorial(n - s - 1)) / np.math.factorial(n)
-        )
-
-    # @show_time
-    def shapley(self, max_coalition_size: bool = 2, normalize: bool = True) -> "MTA":
+    @timed(paths=_paths)
+    def shapley(self, max_subset_size: int = 3, normalize: bool = True) -> "MTA":
 
         """
         Shapley model; channels are players, the characteristic function maps a coalition A to the
-        the total number of conversions generated by all the subsets of the coalition
+        the total number of conversions generated by all the subsets of the coalition with up to
+        max_subset_size channels
+
+        the values are exact (all coalitions, of every size) and computed in closed form per path, see
+        shapley_values
 
         see https://medium.com/data-from-the-trenches/marketing-attribution-e7fa7ae9e919
         """
 
-        self.get_generated_conversions(max_subset_size=3)
-
-        self.phi = defaultdict(float)
+        phi = shapley_values(
+            *self.journeys.distinct(), self.journeys.conversions, len(self.channels), max_subset_size
+        )
 
-        for ch in self.channels:
-            # all subsets of channels that do NOT include ch
-            for n in range(1, max_coalition_size + 1):
-                for tup in combinations(set(self.channels) - {ch}, n):
-                    self.phi[ch] += (self.v(tup + (ch,)) - self.v(tup)) * self.w(
-                        len(tup), len(self.channels)
-                    )
+        self.phi = defaultdict(float, zip(self.channels, phi))
 
         # if normalize:
         #     self.phi = self.normalize_dict(self.phi)
@@ -612,6 +928,18 @@ class MTA:
 
         return self
 
+    @property
+    def data(self) -> pd.DataFrame:
+
+        """
+        the paths as a data frame with lists in path (see JourneyStore.to_frame); only built on first
+        use as none of the models need it
+        """
+
+        if self._data[0] is not self.journeys:
+            self._data = (self.journeys, self.journeys.to_frame())
+
+        return self._data[1]
 
     def show(self) -> None:
 
@@ -636,18 +964,15 @@ class MTA:
         beta_den = defaultdict(float)
         omega_den = defaultdict(float)
 
-        for u, row in enumerate(self.data.itertuples()):
+        exposure_times = np.split(self.journeys.exposure, self.journeys.offsets[1:-1])
 
-            p = self.pi(
-                row.path, row.exposure_times, row.total_conversions, beta, omega
-            )
+        for u, (row, times) in enumerate(zip(self.data.itertuples(), exposure_times)):
+
+            p = self.pi(row.path, times, row.total_conversions, beta, omega)
 
             r = copy.deepcopy(row.path)
 
-            dts = [
-                (arrow.get(row.exposure_times[-1]) - arrow.get(t)).seconds
-                for t in row.exposure_times
-            ]
+            dts = list(times[-1] - times)
 
             while r:
 
@@ -1,40 +1,51 @@
 from __future__ import annotations
 
+import json
+import os
+import sys
 import pandas as pd
 import typing
 import numpy as np
-import config
 # type: ignore
 import mta_algorithms as mta_
-from google.cloud import bigquery
+from utils.channels import AdSourceTable, SourceNormalizer
+from utils.data import aggregate_paths, merge_aggregates, push_aggregate, split_by_shop
+from utils.parallel import fit_shops
+from utils.parsing import parse_list_columns
+from utils.profiling import Profile, stage, timed, timed_iter
+from utils.storage import JOURNEYS_PATH
+from mta_online import OnlineAttribution
+from mta_sink import OrderSink
+from mta_sources import JOURNEY_COLUMNS, FileSource, JourneySource
 from datetime import timedelta
-import ast
+from itertools import chain
 
 names_sources_path = "data/names_sources.txt"
 
 class Mta_Conversion():
-    def __init__(self, shop) -> None:
+    def __init__(self,
+                 shop,
+                 workers: int = 1,
+                 source: JourneySource = None,
+                 chunk_size: int = 100000) -> None:
 
         """
         Args:
-            shops (list):  - shop name
+            shops (list):                 - shop name
+            workers (int):                - processes fitting the shops in parallel
+            source (JourneySource):       - where journeys are read from (see mta_sources), the local
+                                            Parquet dataset (utils.storage.JOURNEYS_PATH) if None
+            chunk_size (int):             - journeys per chunk read from the source
         """
         self.shop:   list           = shop
+        self.source: JourneySource  = FileSource(JOURNEYS_PATH) if source is None else source
+        self.chunk_size: int        = chunk_size
+        self.workers: int           = workers
         self.data:   pd.DataFrame   = pd.DataFrame()
         self.budget: dict           = {}
-        self.adid_source_dict: dict = {}
+        self.ad_sources: AdSourceTable = AdSourceTable()
 
-        self.names_sources = open(names_sources_path, "r")
-        self.names_sources = self.names_sources.read()
-        self.names_sources = list(map(lambda x: x.split(','),
-                                                self.names_sources.replace("'", '')
-                                                                  .replace("]", '')
-                                                                  .replace("[", '')
-                                                                  .replace('"', '')
-                                                                  .replace(' ', '')
-                                                                  .split(';')))
-
-        self.FB_LIST, self.GOOGLE_LIST, self.TIKTOK_LIST, self.SNAPCHAT_LIST, self.PINTEREST_LIST, self.KLAVIYO_LIST, self.EMAIL_LIST, self.INFLUENCER_LIST = self.names_sources
+        self.sources = SourceNormalizer(names_sources_path)
 
     def clean_data(self, path:list) -> list:
         """
@@ -43,67 +54,42 @@ class Mta_Conversion():
         Returns:
             new_path (list[str]): - clean customer journey path
         """
-        new_path = []
-
-        for source in path:
-            source = source.lower()
-            source = source.replace("\n", '')
-            source = source.replace("(", '')
-            source = source.replace(")", '')
-            source = source.replace("[", '')
-            source = source.replace("]", '')
-            source = source.replace("'", '')
-            if source in self.FB_LIST:
-                source = 'facebook'
-            elif source in self.GOOGLE_LIST:
-                source = 'google'
-            elif source in self.TIKTOK_LIST:
-                source = 'tiktok'
-            elif source in self.SNAPCHAT_LIST:
-                source = 'snapchat'
-            elif source in self.PINTEREST_LIST:
-                source = 'pinterest'
-            elif source in self.KLAVIYO_LIST:
-                source = 'klavio'
-            elif source in self.EMAIL_LIST:
-                source = 'email'
-            elif source in self.INFLUENCER_LIST:
-                source = 'influencer'
-            elif source == '':
-                source = 'unset'
-            # else:
-            #     source = 'other'
-            new_path.append(source)
-
-        return new_path
-
-    def prep_data(self, mta_level:  str='adid') -> dict:
+        return self.sources.normalize_path(path)
+
+    def get_data(self, mta_level: str='adid', start=None, end=None) -> typing.Iterator[pd.DataFrame]:
         """
         Args:
             mta_level (str):            - source or adid
+            start (datetime):           - first journey_end_ts (inclusive), unbounded if None
+            end (datetime):             - last journey_end_ts (exclusive), unbounded if None
+        Returns:
+            chunks (iterator):          - journeys of self.shop in chunks of at most self.chunk_size,
+                                          paths parsed to lists and sources normalized
+        """
+        columns = [c for c in JOURNEY_COLUMNS if mta_level == 'adid' or c != 'tw_adid']
+        for chunk in timed_iter('read', self.source.chunks(columns, self.shop, start, end, self.chunk_size)):
+            # serialized paths are parsed in bulk, malformed rows are logged and dropped
+            with stage('parse', rows=len(chunk)):
+                chunk = parse_list_columns(chunk, ['tw_source', 'tw_adid']).reset_index(drop=True)
+            with stage('normalize', rows=len(chunk)):
+                chunk['tw_source'] = self.sources.normalize_paths(chunk['tw_source'])
+                chunk['total_price'] = chunk['total_price'].astype(float)
+                chunk['journey_end_ts'] = pd.to_datetime(chunk['journey_end_ts'])
+            yield chunk
+
+    def prep_data(self, mta_level:  str='adid', aggregated: pd.DataFrame=None) -> dict:
+        """
+        Args:
+            mta_level (str):            - source or adid
+            aggregated (pd.DataFrame):  - paths already aggregated (see aggregate_paths), from self.data if None
         Returns:
             mta_data (pd.DataFrame):    - data for mta
         """
-        # make a string path with > delimeter. Ex: facebook>google>facebook
-        self.data[f'path'] = self.data[f'tw_{mta_level}'].apply(lambda x: '>'.join(x))
-        # for each shop from dataframe prepare dataset
-        mta_data_shops = {}
-        for shop in self.data.shop_name.unique():
-            total_conv = {}
-            data_shop = self.data[self.data.shop_name == shop]
-            # for each unique path calculate its conversion and lost customers
-            for el in data_shop['path'].unique():
-                data_path = data_shop[data_shop['path'] == el]
-                tot_conv = data_path[data_path.journey_success == 1].shape[0]
-                total_conversion_value = data_path[data_path.journey_success == 1].total_price.sum()
-                tot_null = data_path[data_path.journey_success == 0].shape[0]
-                total_conv[el] = {'total_conversions': tot_conv,
-                                  'total_conversion_value': total_conversion_value,
-                                  'total_null': tot_null}
-            mta_data = pd.DataFrame(total_conv).T.reset_index().rename(columns={'index':'path'})
-            mta_data_shops[f'{shop}'] = mta_data.shape[0], mta_data
-            # calculate total budget for each shop
-            self.budget[f'{shop}'] = mta_data['total_conversion_value'].sum()
+        if aggregated is None:
+            aggregated = aggregate_paths(self.data, mta_level)
+        mta_data_shops, budget = split_by_shop(aggregated)
+        # calculate total budget for each shop
+        self.budget.update(budget)
 
         return mta_data_shops
 
@@ -121,32 +107,41 @@ class Mta_Conversion():
 
         return mta
 
-    def prep_data_clean_adid(self):
+    def prep_data_clean_adid(self, data: pd.DataFrame=None):
         """
+        Args:
+            data (pd.DataFrame):     - journeys to add pairs from, self.data if None
         Returns:
-            adid_source_dict (dict): - pairs (shop_adid : source) for output
+            ad_sources (AdSourceTable): - pairs ((shop, adid) : source) for output
         """
+        data = self.data if data is None else data
+        adids, sources = data['tw_adid'].tolist(), data['tw_source'].tolist()
         # delete data with null paths (yes, we can lost money, but it's not useful)
-        data_clean = self.data[self.data.tw_adid.astype(str) != self.data.tw_source.astype(str)]
-
-        # create source-shop-adid dict for output
-        data_clean['shop_name_for_flatten'] = data_clean['shop_name'].apply(lambda x: [x]) * data_clean['len_tw_source']
-        ads_flatten = [ad for path in data_clean['tw_adid'].values for ad in path]
-        ss_flatten = [ad for path in data_clean['tw_source'].values for ad in path]
-        shop_flatten = [shop for path in data_clean['shop_name_for_flatten'].values for shop in path]
-        shop_ads_id = [shop_flatten[i].replace(' ', '') + ads_flatten[i].replace(' ', '') for i in range(len(shop_flatten))]
-        self.adid_source_dict = dict(zip(shop_ads_id, ss_flatten))
+        keep = np.array([a != s and len(a) == len(s) for a, s in zip(adids, sources)], dtype=bool)
+        data_clean = data[keep]
+
+        # one (shop, adid, source) row per touch, added to the table in one pass
+        lengths = data_clean['tw_adid'].map(len).to_numpy(dtype=int)
+        self.ad_sources.update(np.repeat(data_clean['shop_name'].to_numpy(), lengths),
+                               list(chain.from_iterable(data_clean['tw_adid'])),
+                               list(chain.from_iterable(data_clean['tw_source'])))
         return
 
-    def save_data(self, mta_data: dict, mta_level: str) -> list:
+    def save_data(self, mta_data: dict, mta_level: str, workers: int = None) -> list:
         """
         Args:
             mta_data (pd.DataFrame): - data for mta
             mta_level (str):         - source or adid
+            workers (int):           - processes fitting the shops in parallel, self.workers if None
         Returns:
             mta_result (list):       - list with coef and conversion
         """
         mta_result = []
+        # the same models as calc_mta, shops fitted on a process pool; results keep the order of mta_data
+        with stage('fit', paths=sum(n_paths for n_paths, _ in mta_data.values())):
+            fits = fit_shops(mta_data,
+                             ('markov', 'shapley'),
+                             workers=self.workers if workers is None else workers)
 
         for shop_name in mta_data:
             shop_res = {}
@@ -155,23 +150,16 @@ class Mta_Conversion():
                               {'model':'shapley', 'influence_percent':[], 'conversion':[]}
                                 ]
 
-            # errors and empty dataframes check
-            if mta_data[shop_name][0] == 0:
-                shop_res['data'] = models_results
-                mta_result.append(shop_res)
-                continue
-            try:
-                # mta calculation
-                mta = self.calc_mta(mta_data[shop_name][1])
-            except ZeroDivisionError:
+            # errors (ZeroDivisionError) and empty dataframes check
+            if fits.get(shop_name) is None:
                 shop_res['data'] = models_results
                 mta_result.append(shop_res)
                 continue
 
             # normalization
-            values_markov = list(mta.attribution['markov'].values()) / np.sum(list(mta.attribution['markov'].values()))
-            values_shapley = list(mta.attribution['shapley'].values()) / np.sum(list(mta.attribution['shapley'].values()))
-            channels = mta.channels
+            values_markov = fits[shop_name]['markov'] / np.sum(fits[shop_name]['markov'])
+            values_shapley = fits[shop_name]['shapley'] / np.sum(fits[shop_name]['shapley'])
+            channels = fits[shop_name]['channels']
 
             if mta_level == 'source':
                 for el in range(len(values_markov)):
@@ -196,11 +184,16 @@ class Mta_Conversion():
                                          ]
 
             elif mta_level == 'adid':
+                # sources of all ads of the shop in one join on the (shop, adid) table
+                is_ad = np.array([channel != shop_name for channel in channels], dtype=bool)
+                sources_adid = np.full(len(channels), 'unset', dtype=object)
+                sources_adid[is_ad] = self.ad_sources.lookup(shop_name, np.asarray(channels, dtype=object)[is_ad])
+
                 for el in range(len(values_markov)):
 
-                    source_adid = self.adid_source_dict[shop_name.replace(' ', '')+channels[el].replace(' ', '')] if channels[el] != shop_name else 'unset'
+                    source_adid = sources_adid[el]
 
-                    # add markov. source get by key 'shop_name+adid'
+                    # add markov. source get by key (shop_name, adid)
                     models_results[0]['influence_percent'].append(
                                                 {'adid': channels[el],
                                                  'source': source_adid,
@@ -227,88 +220,285 @@ class Mta_Conversion():
             mta_result.append(shop_res)
         return mta_result
 
-    def order_output(self, mta_result, hour=1) -> list:
+    def _hour_window(self, hour=1) -> tuple:
         """
         Args:
-            mta_result (list):       - list with coef and conversionv
-            hour (int):              - period forlast  orders
+            hour (int):              - period for last orders
+        Returns:
+            window (tuple):          - first and last journey_end_ts of the orders of the last hour
+        """
+        until = self.data.journey_end_ts.max()
+        return until - timedelta(hours=hour), until
+
+    def _hour_orders(self, mta_result, hour=1) -> pd.DataFrame:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversion
+            hour (int):              - period for last orders
+        Returns:
+            orders (pd.DataFrame):   - successful orders of the last hour grouped by the shops of
+                                       mta_result, in data order within a shop (the output order)
+        """
+        since, _ = self._hour_window(hour)
+        data_hour = self.data[(self.data.journey_end_ts >= since) & (self.data.journey_success == 1)]
+
+        shop_rank = data_hour['shop_name'].map({el['shop']: i for i, el in enumerate(mta_result)})
+        orders = data_hour[shop_rank.notna()]
+        return orders.iloc[np.argsort(shop_rank[shop_rank.notna()].to_numpy(), kind='stable')]
+
+    def _coefficients(self, mta_result) -> list:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversion
+        Returns:
+            coefs (list):            - (model, (shop, adid) index, influence percents) for markov and shapley
+        """
+        coefs = []
+        for model_id, model in enumerate(('markov', 'shapley')):
+            pairs = [(el['shop'], x['adid'], x['value']) for el in mta_result for x in el['data'][model_id]['influence_percent']]
+            coefs.append((model,
+                          pd.MultiIndex.from_tuples([c[:2] for c in pairs], names=['shop', 'ad_id']),
+                          np.array([c[2] for c in pairs], dtype=float)))
+        return coefs
+
+    def _order_touches(self, orders: pd.DataFrame, coefs: list) -> tuple:
+        """
+        Args:
+            orders (pd.DataFrame):   - orders to attribute
+            coefs (list):            - output of _coefficients
+        Returns:
+            lengths (np.ndarray):    - number of touches of every order
+            touches (pd.DataFrame):  - one row per touch (see order_attribution)
+        """
+        # explode once: one row per touch
+        lengths = orders['tw_source'].map(len).to_numpy(dtype=int)
+        touches = pd.DataFrame({
+            'order_id': np.repeat(orders['order_id'].to_numpy(), lengths),
+            'shop': np.repeat(orders['shop_name'].to_numpy(), lengths),
+            'source': [source for path in orders['tw_source'] for source in path],
+            'ad_id': [path[x] for path, n in zip(orders['tw_adid'], lengths) for x in range(n)],
+        })
+        price = np.repeat(orders['total_price'].to_numpy(dtype=float), lengths)
+        keys = pd.MultiIndex.from_arrays([touches['shop'], touches['ad_id']])
+
+        for model, index, values in coefs:
+            # integer position of every (shop, adid) in the model's coefficients
+            position = index.get_indexer(keys) if len(index) else np.full(len(keys), -1)
+            if (position < 0).any():
+                raise KeyError(touches['ad_id'][position < 0].iloc[0])
+
+            touches[f'{model}_influence_percent'] = values[position]
+            touches[f'{model}_conversion'] = values[position] * price
+
+        return lengths, touches
+
+    def _nest_orders(self, orders: pd.DataFrame, lengths: np.ndarray, touches: pd.DataFrame) -> list:
+        """
+        Args:
+            orders (pd.DataFrame):   - attributed orders
+            lengths (np.ndarray):    - number of touches of every order
+            touches (pd.DataFrame):  - their touches
         Returns:
             result     (list):       - orders list with coef and conversion
         """
+        # the nested structure is only built at the end, from plain lists
+        columns = {column: touches[column].tolist() for column in touches.columns}
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int).tolist()
+
         result = []
-        data_hour = self.data[(self.data.journey_end_ts >= self.data.journey_end_ts.max() - timedelta(hours=hour)) & (self.data.journey_success == 1)]
-        for el in mta_result:
-            # create dictionaries with ad names and values
-            data_shop = data_hour[(data_hour.shop_name == el['shop']) ]
-            markov_percent = dict(zip([x['adid'] for x in el['data'][0]['influence_percent']],
-                                      [x['value'] for x in el['data'][0]['influence_percent']]))
-
-            shapley_percent = dict(zip([x['adid'] for x in el['data'][1]['influence_percent']],
-                                       [x['value'] for x in el['data'][1]['influence_percent']]))
-
-            for order_ind in data_shop.index:
-                order = data_shop.loc[order_ind]
-                path_source = order['tw_source']
-                path_adid = order['tw_adid']
-                attribution = [
-                    {
-                        "source": path_source[x],
-                        "ad_id": path_adid[x],
-                        "markov": {
-                                "influence_percent": markov_percent[path_adid[x]],
-                                "conversion": markov_percent[path_adid[x]] * data_shop['total_price'][order_ind],
-                            },
-                        "shapley": {
-                                "influence_percent": shapley_percent[path_adid[x]],
-                                "conversion":shapley_percent[path_adid[x]] * data_shop['total_price'][order_ind],
-                            }
-                    }
-                    for x in range(len(path_source)) ]
-
-                result.append(
-                    {
-                        "order_id": order['order_id'],
-                        "shop": el['shop'],
-                        "attribution": attribution
-
-                    }
-                )
+        for k, (order_id, shop) in enumerate(zip(orders['order_id'].tolist(), orders['shop_name'].tolist())):
+            attribution = [
+                {
+                    "source": columns['source'][x],
+                    "ad_id": columns['ad_id'][x],
+                    "markov": {
+                            "influence_percent": columns['markov_influence_percent'][x],
+                            "conversion": columns['markov_conversion'][x],
+                        },
+                    "shapley": {
+                            "influence_percent": columns['shapley_influence_percent'][x],
+                            "conversion": columns['shapley_conversion'][x],
+                        }
+                }
+                for x in range(offsets[k], offsets[k + 1]) ]
+
+            result.append(
+                {
+                    "order_id": order_id,
+                    "shop": shop,
+                    "attribution": attribution
+
+                }
+            )
         return result
 
+    def order_attribution(self, mta_result, hour=1) -> pd.DataFrame:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversion
+            hour (int):              - period for last orders
+        Returns:
+            touches (pd.DataFrame):  - one row per touch of the orders of the last hour: order_id, shop,
+                                       source, ad_id and {model}_influence_percent, {model}_conversion
+                                       for markov and shapley
+        """
+        return self._order_touches(self._hour_orders(mta_result, hour), self._coefficients(mta_result))[1]
+
+    def order_chunks(self, mta_result, hour=1, chunk_size=10000, flat=False, after=None) -> typing.Iterator[tuple]:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversion
+            hour (int):              - period for last orders
+            chunk_size (int):        - orders per chunk
+            flat (bool):             - chunks as per-touch tables (see order_attribution) instead of lists
+            after:                   - order_id to resume after, e.g. the last one written by a resumed
+                                       sink; ValueError if it is not exactly one of the orders
+        Returns:
+            chunks (iterator):       - (orders done after the chunk, order_id of its last order, chunk);
+                                       only one chunk of touches is held in memory at a time
+        """
+        orders = self._hour_orders(mta_result, hour)
+        coefs = self._coefficients(mta_result)
+
+        start = 0
+        if after is not None:
+            match = np.flatnonzero(orders['order_id'].to_numpy() == after)
+            if len(match) != 1:
+                raise ValueError(f'cannot resume after order {after!r}: it is not exactly one of the orders')
+            start = int(match[0]) + 1
+
+        for begin in range(start, len(orders), chunk_size):
+            chunk = orders.iloc[begin:begin + chunk_size]
+            lengths, touches = self._order_touches(chunk, coefs)
+            last = chunk['order_id'].iloc[-1]
+            yield (begin + len(chunk),
+                   last.item() if isinstance(last, np.generic) else last,
+                   touches if flat else self._nest_orders(chunk, lengths, touches))
+
+    def order_output(self, mta_result, hour=1, flat=False, chunk_size=None) -> list:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversionv
+            hour (int):              - period forlast  orders
+            flat (bool):             - return the per-touch table of order_attribution instead
+            chunk_size (int):        - if set, return an iterator over chunks of chunk_size orders
+        Returns:
+            result     (list):       - orders list with coef and conversion
+        """
+        if chunk_size is not None:
+            return (chunk for _, _, chunk in self.order_chunks(mta_result, hour, chunk_size, flat))
+
+        orders = self._hour_orders(mta_result, hour)
+        lengths, touches = self._order_touches(orders, self._coefficients(mta_result))
+        return touches if flat else self._nest_orders(orders, lengths, touches)
+
+    def write_orders(self, mta_result, sink: OrderSink, hour=1, chunk_size=10000) -> int:
+        """
+        Args:
+            mta_result (list):       - list with coef and conversion
+            sink (OrderSink):        - NDJSONSink or ParquetSink; a sink opened on an existing output
+                                       resumes after the last order it has written, ValueError if that
+                                       output holds another window of orders
+            hour (int):              - period for last orders
+            chunk_size (int):        - orders per chunk
+        Returns:
+            orders (int):            - number of orders in the output
+        """
+        since, until = self._hour_window(hour)
+        sink.begin({'hour': hour, 'from': str(since), 'to': str(until)})
+        for done, last, chunk in self.order_chunks(mta_result, hour, chunk_size, flat=sink.flat, after=sink.last_order):
+            sink.write(chunk, done, last)
+        sink.close()
+
+        return sink.orders
+
+    @timed('mta_conversion')
     def mta_conversion(self,
-                       mta_level:   str='adid') -> tuple:
+                       mta_level:   str='adid',
+                       sink:        OrderSink=None,
+                       start=None,
+                       end=None,
+                       hour:        int=1) -> tuple:
         """
         Args:
             mta_level (str):      - source or adid
+            start (datetime):     - first journey_end_ts read (inclusive), unbounded if None
+            end (datetime):       - last journey_end_ts read (exclusive), unbounded if None
+            hour (int):           - period for last orders in the order output
+            sink (OrderSink):     - if set, orders are written to the sink chunk by chunk instead of
+                                    being returned
         Returns:
             mta_result (list):      - list with coef and conversion
-            mta_order_result (list) - orders list with coef and conversion
+            mta_order_result (list) - orders list with coef and conversion (empty with a sink)
         """
 
         mta_result = []
-        self.get_data(mta_level)
-        self.data.reset_index(drop=True, inplace=True)
-        self.data['tw_source'] = self.data['tw_source'].apply(lambda x: ast.literal_eval(x))
-        self.data['tw_source'] = self.data['tw_source'].apply(lambda x: self.clean_data(x))
-
-        if mta_level == 'adid':
-            self.prep_data_clean_adid()
-
-        self.data['total_price'] = self.data['total_price'].astype(float)
-        mta_data = self.prep_data(mta_level)
-        mta_result = self.save_data(mta_data, mta_level)
-        if mta_level == 'adid':
-            mta_order_result = self.order_output(mta_result)
+        self.ad_sources = AdSourceTable()
+        partials = []
+        self.data = pd.DataFrame()
+
+        # journeys are consumed chunk by chunk: paths are aggregated per chunk and merged pairwise (see
+        # push_aggregate), only the journeys that can still fall into the output hour are kept
+        with stage('get_data'):
+            for chunk in self.get_data(mta_level, start, end):
+                if mta_level == 'adid':
+                    with stage('clean', rows=len(chunk)):
+                        self.prep_data_clean_adid(chunk)
+                with stage('aggregate', rows=len(chunk)):
+                    push_aggregate(partials, aggregate_paths(chunk, mta_level))
+
+                self.data = pd.concat([self.data, chunk], ignore_index=True)
+                self.data = self.data[self.data.journey_end_ts >= self.data.journey_end_ts.max() - timedelta(hours=hour)]
+
+        if not partials:
+            return [], []
+        with stage('merge', partials=len(partials)):
+            aggregated = merge_aggregates([frame for _, frame in partials])
+        with stage('prep', paths=len(aggregated)):
+            mta_data = self.prep_data(mta_level, aggregated)
+        with stage('save'):
+            mta_result = self.save_data(mta_data, mta_level)
+        if mta_level == 'adid' and sink is not None:
+            with stage('order_output', rows=len(self.data)):
+                self.write_orders(mta_result, sink, hour)
+            return mta_result, []
+        elif mta_level == 'adid':
+            with stage('order_output', rows=len(self.data)):
+                mta_order_result = self.order_output(mta_result, hour)
             return mta_result, mta_order_result
         else:
             return mta_result, []
 
+    def online(self,
+               mta_level:     str='adid',
+               refresh_every: timedelta=timedelta(hours=1)) -> OnlineAttribution:
+        """
+        Args:
+            mta_level (str):            - source or adid
+            refresh_every (timedelta):  - stream time between two refits of the coefficients
+        Returns:
+            online (OnlineAttribution): - streaming counterpart of mta_conversion, fed with
+                                          OnlineAttribution.update(new_journeys)
+        """
+        return OnlineAttribution(mta_level=mta_level,
+                                 refresh_every=refresh_every,
+                                 sources=self.sources)
+
 if __name__ == "__main__":
 
 
     query_mta = pd.read_json('mta/example_query.json')
     shop = list(query_mta['shop'])
-    mta_conv = Mta_Conversion(shop=shop)
-    mta_conv_result = mta_conv.mta_conversion(mta_level=query_mta['mta_level'][0])
+    # production runs pass mta_sources.BigQuerySource(<journeys table>)
+    mta_conv = Mta_Conversion(shop=shop, source=FileSource(JOURNEYS_PATH))
+
+    # MTA_PROFILE=1 reports the time of every stage on stderr, MTA_PROFILE=memory their peak memory too
+    profile = os.environ.get('MTA_PROFILE')
+    if profile:
+        with Profile('mta_conversion', memory=profile == 'memory') as run:
+            mta_conv_result = mta_conv.mta_conversion(mta_level=query_mta['mta_level'][0])
+        print(json.dumps(run.report(), indent=2), file=sys.stderr)
+    else:
+        mta_conv_result = mta_conv.mta_conversion(mta_level=query_mta['mta_level'][0])
 
     print(mta_conv_result)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+import mta_algorithms as mta_
+from utils.channels import SourceNormalizer
+from utils.data import aggregate_paths
+
+# fixed states of the transition count matrix, channels follow from index 3 on in order of arrival
+START, CONV, NULL = 0, 1, 2
+
+
+class ShopCounts():
+    def __init__(self) -> None:
+
+        """
+        Sufficient statistics of one shop's journeys for the markov and shapley models; every update
+        only touches the distinct paths of the new journeys.
+        """
+        self.channels:     List[str]        = []
+        self.channel_ids:  Dict[str, int]   = {}
+        # loop-free path (tuple of channel ids) -> [conversions, conversion value, nulls]
+        self.paths:        Dict[tuple, np.ndarray] = {}
+        # transitions[i, j] - moves from state i to state j, see START, CONV, NULL
+        self.transitions:  np.ndarray       = np.zeros((3, 3))
+        # sorted tuple of the distinct channel ids of a path -> conversions
+        self.coalitions:   Dict[tuple, float] = defaultdict(float)
+        self.budget:       float            = 0.0
+
+    def _ids(self, names: List[str]) -> np.ndarray:
+        """
+        Args:
+            names (list[str]):   - channel names, new ones are appended
+        Returns:
+            ids (np.ndarray):    - channel ids of names
+        """
+        for name in names:
+            if name not in self.channel_ids:
+                self.channel_ids[name] = len(self.channels)
+                self.channels.append(name)
+
+        n = len(self.channels) + 3
+        if self.transitions.shape[0] < n:
+            grown = np.zeros((n, n))
+            grown[:self.transitions.shape[0], :self.transitions.shape[1]] = self.transitions
+            self.transitions = grown
+
+        return np.array([self.channel_ids[name] for name in names], dtype=np.int32)
+
+    def update(self, aggregated: pd.DataFrame) -> None:
+        """
+        Args:
+            aggregated (pd.DataFrame):  - new journeys of the shop aggregated by path (see aggregate_paths)
+        """
+        batch = mta_.JourneyStore.from_frame(aggregated, sep='>')
+        ids = self._ids(batch.channel_names)
+        store = mta_.JourneyStore(ids[batch.channels], batch.offsets, batch.conversions, batch.values,
+                                  batch.nulls, self.channels).collapse_loops()
+
+        # the same pair counts as MTA.transition_counts, added onto the running matrix
+        n = self.transitions.shape[0]
+        touch = store.channels.astype(np.int64) + 3
+        first, last = store.offsets[:-1], store.offsets[1:] - 1
+        inner = np.ones(len(touch), dtype=bool)
+        inner[last] = False
+        journeys = store.conversions + store.nulls
+
+        src = np.concatenate([np.full(len(store), START), touch[inner], touch[last], touch[last]])
+        dst = np.concatenate([touch[first], touch[np.flatnonzero(inner) + 1],
+                              np.full(len(store), CONV), np.full(len(store), NULL)])
+        weights = np.concatenate([journeys, journeys[store.path_index[inner]], store.conversions, store.nulls])
+        self.transitions += np.bincount(src * n + dst, weights=weights, minlength=n * n).reshape(n, n)
+
+        members, offsets = store.distinct()
+        for k, path in enumerate(store.paths()):
+            counts = np.array([store.conversions[k], store.values[k], store.nulls[k]])
+            key = tuple(path.tolist())
+            self.paths[key] = self.paths[key] + counts if key in self.paths else counts
+            if store.conversions[k] > 0:
+                self.coalitions[tuple(sorted(members[offsets[k]:offsets[k + 1]].tolist()))] += store.conversions[k]
+
+        self.budget += store.values.sum()
+
+    def markov(self) -> np.ndarray:
+        """
+        Returns:
+            removal_effects (np.ndarray): - removal effect of every channel (see MTA.markov)
+        """
+        p_conv, p_removed = mta_.absorbing_removal_probabilities(
+            mta_.transition_probabilities(self.transitions), start_idx=START, conv_idx=CONV, null_idx=NULL
+        )
+        if not p_conv:
+            raise ZeroDivisionError("conversion probability is zero, removal effects are undefined")
+
+        return (p_conv - p_removed[3:3 + len(self.channels)]) / p_conv
+
+    def shapley(self, max_subset_size: int = 3) -> np.ndarray:
+        """
+        Args:
+            max_subset_size (int): - largest channel subsets generating conversions (see MTA.shapley)
+        Returns:
+            phi (np.ndarray):      - shapley value of every channel
+        """
+        coalitions = list(self.coalitions)
+        conversions = np.array([self.coalitions[c] for c in coalitions], dtype=float)
+        members = np.array([c for coalition in coalitions for c in coalition], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum([len(c) for c in coalitions])]).astype(np.int64)
+        return mta_.shapley_values(members, offsets, conversions, len(self.channels), max_subset_size)
+
+
+class OnlineAttribution():
+    def __init__(self,
+                 mta_level: str = 'adid',
+                 refresh_every: timedelta = timedelta(hours=1),
+                 sources: SourceNormalizer = None) -> None:
+
+        """
+        Online mode of Mta_Conversion: completed journeys arrive in batches, the per-shop counts are
+        updated with the new journeys only, the attribution coefficients are refit from the counts once
+        refresh_every of stream time (journey_end_ts) has passed and every new order is attributed with
+        the current coefficients.
+
+        Args:
+            mta_level (str):              - source or adid
+            refresh_every (timedelta):    - stream time between two refits of the coefficients
+            sources (SourceNormalizer):   - normalizer applied to tw_source, None if already clean
+        """
+        self.mta_level:     str               = mta_level
+        self.refresh_every: timedelta         = refresh_every
+        self.sources:       SourceNormalizer  = sources
+        self.counts:        Dict[str, ShopCounts] = {}
+        # shop -> {'markov': {channel: influence percent}, 'shapley': {...}}
+        self.coefficients:  Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.last_refresh = None
+        self.now = None
+
+    def update(self, journeys: pd.DataFrame) -> list:
+        """
+        Args:
+            journeys (pd.DataFrame):  - new completed journeys (same columns as Mta_Conversion.data,
+                                        paths as lists)
+        Returns:
+            result (list):            - new orders with coef and conversion (see Mta_Conversion.order_output)
+        """
+        if not len(journeys):
+            return []
+
+        journeys = journeys.reset_index(drop=True)
+        if self.sources is not None:
+            journeys['tw_source'] = self.sources.normalize_paths(journeys['tw_source'])
+        journeys['total_price'] = journeys['total_price'].astype(float)
+
+        for shop, aggregated in aggregate_paths(journeys, self.mta_level).groupby('shop_name', sort=False):
+            self.counts.setdefault(shop, ShopCounts()).update(aggregated.drop(columns='shop_name'))
+
+        self.now = journeys['journey_end_ts'].max() if self.now is None else max(self.now, journeys['journey_end_ts'].max())
+        if self.last_refresh is None or self.now - self.last_refresh >= self.refresh_every:
+            self.refresh()
+
+        return self.attribute_orders(journeys[journeys.journey_success == 1])
+
+    def refresh(self) -> None:
+        """
+        Refits the markov and shapley coefficients of every shop from the running counts.
+        """
+        for shop, counts in self.counts.items():
+            try:
+                markov = counts.markov()
+                shapley = counts.shapley()
+            except ZeroDivisionError:
+                self.coefficients[shop] = {'markov': {}, 'shapley': {}}
+                continue
+            # normalization
+            self.coefficients[shop] = {
+                'markov': dict(zip(counts.channels, markov / np.sum(markov))),
+                'shapley': dict(zip(counts.channels, shapley / np.sum(shapley))),
+            }
+        self.last_refresh = self.now
+
+    def attribute_orders(self, orders: pd.DataFrame) -> list:
+        """
+        Args:
+            orders (pd.DataFrame):   - successful journeys
+        Returns:
+            result (list):           - orders list with coef and conversion
+        """
+        result = []
+        column = f'tw_{self.mta_level}'
+        for order in orders.itertuples(index=False):
+            coefs = self.coefficients.get(order.shop_name, {'markov': {}, 'shapley': {}})
+            attribution = []
+            for x, channel in enumerate(getattr(order, column)):
+                touch = {"source": order.tw_source[x]}
+                if self.mta_level == 'adid':
+                    touch["ad_id"] = channel
+                for model in ('markov', 'shapley'):
+                    # channels that arrived after the last refresh get no credit yet
+                    percent = coefs[model].get(channel, 0.0)
+                    touch[model] = {"influence_percent": percent, "conversion": percent * order.total_price}
+                attribution.append(touch)
+
+            result.append({"order_id": order.order_id, "shop": order.shop_name, "attribution": attribution})
+
+        return result
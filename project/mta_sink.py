@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import os
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class OrderSink(ABC):
+    # chunks as per-touch tables (True) or as lists of nested orders (False), see Mta_Conversion.order_chunks
+    flat: bool = False
+
+    def __init__(self, path: str) -> None:
+
+        """
+        Incremental writer for order attribution chunks. The window the orders come from is committed
+        to <path>.checkpoint before the first chunk, and after every chunk the number of orders written
+        so far and the order_id of the last one; close() marks the output finished. A sink opened on an
+        existing output picks up from there, so a backfill that stopped half way resumes after its last
+        written order, and a run over another window fails instead of extending the old output.
+
+        Args:
+            path (str):             - output file or directory
+        """
+        self.path:       str  = path
+        self.checkpoint: str  = f'{path}.checkpoint'
+        self.resumed:    bool = os.path.exists(self.checkpoint)
+        self.state:      dict = {'window': None, 'orders': 0, 'last_order': None, 'finished': False}
+
+        if self.resumed:
+            with open(self.checkpoint) as f:
+                self.state.update(json.load(f))
+
+    @property
+    def orders(self) -> int:
+        return self.state['orders']
+
+    @property
+    def last_order(self):
+        return self.state['last_order']
+
+    def begin(self, window: dict) -> None:
+        """
+        Args:
+            window (dict):          - bounds of the orders written (JSON values), checked against the
+                                      checkpoint of a resumed output
+        """
+        if self.resumed and self.state['window'] != window:
+            raise ValueError(f"{self.path} holds the orders of {self.state['window']}, not of {window}")
+        self._commit(window=window)
+
+    def _refuse_existing(self) -> None:
+        # an output without a checkpoint is not ours to resume, and not ours to overwrite
+        if not self.resumed and os.path.exists(self.path) and (
+                os.listdir(self.path) if os.path.isdir(self.path) else os.path.getsize(self.path)):
+            raise FileExistsError(f'{self.path} exists and has no checkpoint to resume from')
+
+    def _commit(self, **state) -> None:
+        """
+        Args:
+            **state:                - new checkpoint values, written atomically
+        """
+        self.state.update(state)
+        tmp = f'{self.checkpoint}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.checkpoint)
+
+    @abstractmethod
+    def write(self, chunk, orders: int, last_order) -> None:
+        """
+        Args:
+            chunk:                  - next chunk of orders
+            orders (int):           - orders written once the chunk is written
+            last_order:             - order_id of the chunk's last order
+        """
+
+    def close(self) -> None:
+        self._commit(finished=True)
+
+
+class NDJSONSink(OrderSink):
+    def __init__(self, path: str) -> None:
+
+        """
+        One order (nested, as in Mta_Conversion.order_output) per line.
+
+        Args:
+            path (str):             - output .ndjson file
+        """
+        super().__init__(path)
+        self._refuse_existing()
+        self.state.setdefault('offset', 0)
+
+        # drop whatever a crashed run wrote after its last checkpoint
+        self.file = open(path, 'ab')
+        self.file.truncate(self.state['offset'])
+        self.file.seek(self.state['offset'])
+
+    def write(self, chunk: list, orders: int, last_order) -> None:
+        self.file.write(''.join(json.dumps(order) + '\n' for order in chunk).encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._commit(orders=orders, last_order=last_order, offset=self.file.tell())
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+class ParquetSink(OrderSink):
+    flat = True
+
+    def __init__(self, path: str) -> None:
+
+        """
+        One Parquet file per chunk of per-touch rows (see Mta_Conversion.order_attribution) in a
+        directory that reads as one dataset.
+
+        Args:
+            path (str):             - output directory
+        """
+        super().__init__(path)
+        self._refuse_existing()
+        self.state.setdefault('parts', 0)
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, chunk: pd.DataFrame, orders: int, last_order) -> None:
+        # a part left by a crashed run has the same name and is overwritten
+        part = os.path.join(self.path, f"part-{self.state['parts']:06d}.parquet")
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), part)
+        self._commit(orders=orders, last_order=last_order, parts=self.state['parts'] + 1)
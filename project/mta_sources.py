@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import typing
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from utils.storage import LIST_COLUMNS, PARTITIONING
+
+# columns Mta_Conversion needs from a journey source
+JOURNEY_COLUMNS = ['order_id', 'shop_name', 'journey_end_ts', 'journey_success', 'total_price',
+                   'len_tw_source', 'tw_source', 'tw_adid']
+
+
+class JourneySource(ABC):
+    @abstractmethod
+    def chunks(self,
+               columns:    list = None,
+               shops:      list = None,
+               start=None,
+               end=None,
+               chunk_size: int = 100000) -> typing.Iterator[pd.DataFrame]:
+        """
+        Reads journeys in bounded-size chunks.
+
+        Args:
+            columns (list[str]):   - columns to read, all if None
+            shops (list[str]):     - shops to read, all if None
+            start (datetime):      - first journey_end_ts (inclusive), unbounded if None
+            end (datetime):        - last journey_end_ts (exclusive), unbounded if None
+            chunk_size (int):      - maximum rows per chunk
+        Returns:
+            chunks (iterator):     - DataFrames of at most chunk_size journeys; list columns come as the
+                                     backend stores them (lists or their string form)
+        """
+
+
+def filter_chunk(chunk: pd.DataFrame, columns: list = None, shops: list = None, start=None, end=None) -> pd.DataFrame:
+    """
+    Applies the filters and the projection of JourneySource.chunks to a chunk read without them.
+    """
+    keep = pd.Series(True, index=chunk.index)
+    if shops is not None:
+        keep &= chunk['shop_name'].isin(shops)
+    if start is not None or end is not None:
+        ts = pd.to_datetime(chunk['journey_end_ts'])
+        if start is not None:
+            keep &= ts >= pd.Timestamp(start)
+        if end is not None:
+            keep &= ts < pd.Timestamp(end)
+    chunk = chunk[keep]
+
+    return chunk if columns is None else chunk[[c for c in columns if c in chunk.columns]]
+
+
+class FileSource(JourneySource):
+    def __init__(self, path: str) -> None:
+
+        """
+        Local journeys: a partitioned Parquet dataset (see utils.storage), a .csv export or a .pickle.
+        The dataset is read batch by batch with shop/day partition pruning, the CSV in chunks of rows;
+        a pickle has to be loaded whole and is only sliced into chunks.
+
+        Args:
+            path (str):            - dataset directory or file
+        """
+        self.path: str = path
+
+    def chunks(self, columns=None, shops=None, start=None, end=None, chunk_size=100000):
+        if os.path.isdir(self.path):
+            dataset = ds.dataset(self.path, format='parquet', partitioning=PARTITIONING)
+            condition = None
+            if shops is not None:
+                condition = ds.field('shop_name').isin(list(shops))
+            for bound, op in ((start, '__ge__'), (end, '__le__')):
+                if bound is not None:
+                    c = getattr(ds.field('journey_date'), op)(pd.Timestamp(bound).date())
+                    condition = c if condition is None else condition & c
+            read = None if columns is None else list(dict.fromkeys(list(columns) + ['shop_name', 'journey_end_ts']))
+
+            for batch in dataset.to_batches(columns=read, filter=condition, batch_size=chunk_size):
+                chunk = batch.to_pandas()
+                # pyarrow hands out numpy arrays for list cells
+                for column in LIST_COLUMNS:
+                    if column in chunk.columns:
+                        chunk[column] = batch.column(column).to_pylist()
+                yield filter_chunk(chunk, columns, shops, start, end)
+
+        elif self.path.endswith('.csv'):
+            for chunk in pd.read_csv(self.path, index_col=0, chunksize=chunk_size):
+                yield filter_chunk(chunk, columns, shops, start, end)
+
+        else:
+            data = filter_chunk(pd.read_pickle(self.path), columns, shops, start, end)
+            for begin in range(0, len(data), chunk_size):
+                yield data.iloc[begin:begin + chunk_size]
+
+
+class SQLiteSource(JourneySource):
+    def __init__(self, path: str, table: str = 'journeys') -> None:
+
+        """
+        Local stand-in for the warehouse: journeys in an SQLite table, list columns stored in their
+        string form like the warehouse export (see write_sqlite). Filters and projection run in SQL.
+
+        Args:
+            path (str):            - SQLite database file
+            table (str):           - table name
+        """
+        self.path:  str = path
+        self.table: str = table
+
+    def chunks(self, columns=None, shops=None, start=None, end=None, chunk_size=100000):
+        conditions, params = [], []
+        if shops is not None:
+            conditions.append(f"shop_name IN ({', '.join('?' * len(shops))})")
+            params += list(shops)
+        if start is not None:
+            conditions.append('journey_end_ts >= ?')
+            params.append(str(pd.Timestamp(start)))
+        if end is not None:
+            conditions.append('journey_end_ts < ?')
+            params.append(str(pd.Timestamp(end)))
+
+        query = f"SELECT {'*' if columns is None else ', '.join(columns)} FROM {self.table}"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        with sqlite3.connect(self.path) as connection:
+            for chunk in pd.read_sql_query(query, connection, params=params, chunksize=chunk_size):
+                if 'journey_end_ts' in chunk.columns:
+                    chunk['journey_end_ts'] = pd.to_datetime(chunk['journey_end_ts'])
+                yield chunk
+
+
+def write_sqlite(data: pd.DataFrame, path: str, table: str = 'journeys') -> None:
+    """
+    Fills an SQLiteSource from a journeys frame, replacing the table.
+
+    Args:
+        data (pd.DataFrame):       - journeys
+        path (str):                - SQLite database file
+        table (str):               - table name
+    """
+    data = data.copy()
+    for column in LIST_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].map(lambda x: x if isinstance(x, str) else str(list(x)))
+    data['journey_end_ts'] = pd.to_datetime(data['journey_end_ts']).astype(str)
+
+    with sqlite3.connect(path) as connection:
+        data.to_sql(table, connection, if_exists='replace', index=False)
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_shop_ts ON {table} (shop_name, journey_end_ts)')
+
+
+class BigQuerySource(JourneySource):
+    def __init__(self, table: str, client=None) -> None:
+
+        """
+        Journeys table in BigQuery, read page by page.
+
+        Args:
+            table (str):           - fully qualified table id
+            client:                - bigquery.Client, a default one if None
+        """
+        from google.cloud import bigquery
+
+        self.bigquery = bigquery
+        self.table:  str = table
+        self.client      = client if client is not None else bigquery.Client()
+
+    def chunks(self, columns=None, shops=None, start=None, end=None, chunk_size=100000):
+        conditions, params = [], []
+        if shops is not None:
+            conditions.append('shop_name IN UNNEST(@shops)')
+            params.append(self.bigquery.ArrayQueryParameter('shops', 'STRING', list(shops)))
+        if start is not None:
+            conditions.append('journey_end_ts >= @start')
+            params.append(self.bigquery.ScalarQueryParameter('start', 'TIMESTAMP', pd.Timestamp(start).to_pydatetime()))
+        if end is not None:
+            conditions.append('journey_end_ts < @end')
+            params.append(self.bigquery.ScalarQueryParameter('end', 'TIMESTAMP', pd.Timestamp(end).to_pydatetime()))
+
+        query = f"SELECT {'*' if columns is None else ', '.join(columns)} FROM `{self.table}`"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        job = self.client.query(query, job_config=self.bigquery.QueryJobConfig(query_parameters=params))
+        yield from job.result(page_size=chunk_size).to_dataframe_iterable()
@@ -1,131 +1,193 @@
 import pandas as pd
 import numpy as np
+from itertools import chain
 from typing import Dict, Tuple, List, Any
-import mta_algorithms as mta_
+from utils.cube import PathCube
+from utils.data import prep_data_for_markov_shapley, split_by_shop
+from utils.parallel import fit_shops
+
+
+MODELS = ['fta', 'lta', 'linear', 'time-decay', 'position-based', 'markov', 'shapley']
+
+
+def attribute_all(data: pd.DataFrame, shop: str, models: List[str] = MODELS) -> Dict[str, Dict[str, float]]:
+    """
+    Computes several attribution models for one shop at once.
+
+    The heuristic models share a single pass over the orders of the shop with total_price > 0 (see
+    heuristic_attribution). Markov and Shapley share one aggregation of the shop's paths.
+
+    Args:
+        data (pd.DataFrame): Journeys with tw_source_clean, total_price and shop_name columns.
+        shop (str): Shop name.
+        models (list[str]): Any of MODELS.
+
+    Returns:
+        dict: Model name -> {channel: attributed revenue}.
+    """
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise ValueError(f"unknown attribution models: {sorted(unknown)}")
+
+    result = {}
+    heuristics = [model for model in models if model not in ('markov', 'shapley')]
+
+    if heuristics:
+        data_shop = data[(data.shop_name == shop) & (data.total_price > 0)]
+        result.update(heuristic_attribution(data_shop['tw_source_clean'], data_shop['total_price'], heuristics))
+
+    if 'markov' in models or 'shapley' in models:
+        mta_data, budget = prep_data_for_markov_shapley(data[data.shop_name == shop].copy())
+        result.update(_markov_shapley(mta_data, budget, models))
+
+    return result
+
+
+def attribute_cube(cube: PathCube, start_date, end_date, models: List[str] = MODELS) -> Dict[str, Dict[str, float]]:
+    """
+    attribute_all for the journeys of a date range, answered from the daily path cube.
+
+    Args:
+        cube (PathCube): Cube of the shop.
+        start_date (datetime.date): First day (inclusive).
+        end_date (datetime.date): Last day (inclusive).
+        models (list[str]): Any of MODELS.
+
+    Returns:
+        dict: Model name -> {channel: attributed revenue}.
+    """
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise ValueError(f"unknown attribution models: {sorted(unknown)}")
+
+    result = {}
+    heuristics = [model for model in models if model not in ('markov', 'shapley')]
+
+    if heuristics:
+        # every distinct path is weighted by the revenue of its orders in the range
+        paths, revenue = cube.revenue_paths(start_date, end_date)
+        result.update(heuristic_attribution(paths, revenue, heuristics))
+
+    if 'markov' in models or 'shapley' in models:
+        mta_data, budget = split_by_shop(cube.aggregated(start_date, end_date))
+        result.update(_markov_shapley(mta_data, budget, models))
+
+    return result
+
+
+def heuristic_attribution(paths, price, models: List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    The heuristic models in a single pass: paths are exploded into one row per touch and every model
+    is a weighted group sum over the same touch arrays.
+
+    Args:
+        paths (sequence of lists): Channel path of every order (or of every distinct path).
+        price (array-like): Order value (or summed value) of every path.
+        models (list[str]): Any of fta, lta, linear, time-decay, position-based.
+
+    Returns:
+        dict: Model name -> {channel: attributed revenue}.
+    """
+    touches, codes, channels, weights, credited = heuristic_touches(paths, models)
+    price = np.asarray(price, dtype=float)[touches]
+
+    result = {}
+    for model in models:
+        credit = np.bincount(codes, weights=weights[model] * price, minlength=len(channels))
+        result[model] = {channels[c]: credit[c] for c in credited[model]}
+
+    return result
+
+
+def heuristic_touches(paths, models: List[str]) -> Tuple[np.ndarray, np.ndarray, pd.Index, Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """
+    Args:
+        paths (sequence of lists): Channel path of every order (or of every distinct path).
+        models (list[str]): Any of fta, lta, linear, time-decay, position-based.
+
+    Returns:
+        tuple: Path of every touch, its channel code, the channels, model -> share of the order value
+        every touch gets and model -> codes of the channels the model reports.
+    """
+    paths = list(paths)
+    lengths = np.fromiter(map(len, paths), dtype=int, count=len(paths))
+
+    # one row per touch: channel code, position on the path and path length
+    codes, channels = pd.factorize(pd.Series(list(chain.from_iterable(paths)), dtype=object))
+    touches = np.repeat(np.arange(len(paths)), lengths)
+    n_touches = lengths[touches]
+    position = np.arange(len(codes)) - (np.cumsum(lengths) - lengths)[touches]
+    first, last = position == 0, position == n_touches - 1
+
+    weights = {
+        'fta': lambda: first.astype(float),
+        'lta': lambda: last.astype(float),
+        'linear': lambda: 1 / n_touches,
+        # linspace(0, 1, n + 1)[j + 1] / sum(linspace(0, 1, n + 1))
+        'time-decay': lambda: (position + 1) / n_touches / ((n_touches + 1) / 2),
+        'position-based': lambda: np.where(first | last, 0.4, 1 / np.maximum(n_touches - 2, 1) * 0.2),
+    }
+    # channels reported by each model
+    credited = {'fta': codes[first], 'lta': codes[last]}
+
+    return (touches, codes, channels,
+            {model: weights[model]() for model in models},
+            {model: np.unique(credited.get(model, codes)) for model in models})
+
+
+def _markov_shapley(mta_data, budget, models: List[str]) -> Dict[str, Dict[str, float]]:
+    # both models come out of one fit of the shop's paths
+    fitted = [model for model in ('markov', 'shapley') if model in models]
+    shops = _models_attribution(fitted, mta_data, budget)
+    return {model: shops[model][0]['data']['conversion'] if shops[model] else {} for model in fitted}
 
 
 def last_touch_attribution(data: pd.DataFrame, shop: str) -> Dict[str, float]:
-    lta_result = {}
-    data_shop = data[(data.shop_name == shop)&(data.total_price > 0)]
-    for i in data_shop.index:
-        if data_shop['tw_source_clean'][i][-1] in lta_result:
-            lta_result[data_shop['tw_source_clean'][i][-1]] += data_shop['total_price'][i]
-        else:
-            lta_result[data_shop['tw_source_clean'][i][-1]] = data_shop['total_price'][i]
-    
-    return lta_result
+    return attribute_all(data, shop, ['lta'])['lta']
 
 def first_touch_attribution(data: pd.DataFrame, shop: str) -> Dict[str, float]:
-    fta_result = {}
-    data_shop = data[(data.shop_name == shop)&(data.total_price > 0)]
-    for i in data_shop.index:
-        if data_shop['tw_source_clean'][i][0] in fta_result:
-            fta_result[data_shop['tw_source_clean'][i][0]] += data_shop['total_price'][i]
-        else:
-            fta_result[data_shop['tw_source_clean'][i][0]] = data_shop['total_price'][i]
-    return fta_result
+    return attribute_all(data, shop, ['fta'])['fta']
 
 def linear_attribution(data: pd.DataFrame, shop: str) -> Dict[str, float]:
-    linear_result = {}
-    data_shop = data[(data.shop_name == shop)&(data.total_price > 0)]
-    for i in data_shop.index:
-        for j in data_shop['tw_source_clean'][i]:
-            if j in linear_result:
-                linear_result[j] += data_shop['total_price'][i]/len(data_shop['tw_source_clean'][i])
-            else:
-                linear_result[j] = data_shop['total_price'][i]/len(data_shop['tw_source_clean'][i])
-    return linear_result
-
+    return attribute_all(data, shop, ['linear'])['linear']
 
 def time_decay_attribution(data: pd.DataFrame, shop: str) -> Dict[str, float]:
-    time_decay_result = {}
-    data_shop = data[(data.shop_name == shop)&(data.total_price > 0)]
-    for i in data_shop.index:
-        weights = np.linspace(0, 1, len(data_shop['tw_source_clean'][i]) + 1) / sum(np.linspace(0, 1, len(data_shop['tw_source_clean'][i]) + 1))
-        for j in range(len(data_shop['tw_source_clean'][i])):
-            if data_shop['tw_source_clean'][i][j] in time_decay_result:
-                time_decay_result[data_shop['tw_source_clean'][i][j]] += data_shop['total_price'][i]*weights[j + 1]
-            else:
-                time_decay_result[data_shop['tw_source_clean'][i][j]] = data_shop['total_price'][i]*weights[j + 1]
-    return time_decay_result
+    return attribute_all(data, shop, ['time-decay'])['time-decay']
 
 def position_based_attribution(data: pd.DataFrame, shop: str) -> Dict[str, float]:
-    position_based_result = {}
-    data_shop = data[(data.shop_name == shop)&(data.total_price > 0)]
-    for i in data_shop.index:
-        for j in range(len(data_shop['tw_source_clean'][i])):
-            if j == 0 or j == len(data_shop['tw_source_clean'][i])-1:
-                if data_shop['tw_source_clean'][i][j] in position_based_result:
-                    position_based_result[data_shop['tw_source_clean'][i][j]] += data_shop['total_price'][i]* 0.4
-                else:
-                    position_based_result[data_shop['tw_source_clean'][i][j]] = data_shop['total_price'][i]* 0.4
-            else:
-                if data_shop['tw_source_clean'][i][j] in position_based_result:
-                    position_based_result[data_shop['tw_source_clean'][i][j]] += data_shop['total_price'][i]/(len(data_shop['tw_source_clean'][i])-2) * 0.2
-                else:
-                    position_based_result[data_shop['tw_source_clean'][i][j]] = data_shop['total_price'][i]/(len(data_shop['tw_source_clean'][i])-2) * 0.2
-    return position_based_result
+    return attribute_all(data, shop, ['position-based'])['position-based']
 
-def markov_attribution(mta_data, budget):
+def markov_attribution(mta_data, budget, workers: int = 1):
+    return _models_attribution(['markov'], mta_data, budget, workers)['markov']
 
-    mta_result = []
-    for shop_name in mta_data:
-        shop_res = {}
-        shop_res['shop'] = shop_name
-        models_results = {'model':'markov', 'influence_percent':{}, 'conversion':{}}
-                            
-        # errors and empty dataframes check
-        if mta_data[shop_name][0] == 0:
-            shop_res['data'] = models_results
-            mta_result.append(shop_res)
-            continue
-        try:
-            # mta calculation
-            mta = mta_.MTA(mta_data[shop_name][1])
-            mta.markov()
-        except ZeroDivisionError:
-            shop_res['data'] = models_results
-            mta_result.append(shop_res)
-            continue
-        values_markov = list(mta.attribution['markov'].values()) / np.sum(list(mta.attribution['markov'].values()))
-        channels = mta.channels
-        for el in range(len(values_markov)):
-            # add markov
-            models_results['influence_percent'][channels[el]] = values_markov[el]
-            models_results['conversion'][channels[el]] = values_markov[el] * budget[shop_name]
+def shapley_attribution(mta_data: Dict[str, Tuple[int, Any]], budget: Dict[str, float], workers: int = 1) -> List[Dict[str, Any]]:
+    return _models_attribution(['shapley'], mta_data, budget, workers)['shapley']
 
-        shop_res['data'] = models_results
-        mta_result.append(shop_res)
+def _models_attribution(models: List[str], mta_data: Dict[str, Tuple[int, Any]], budget: Dict[str, float], workers: int = 1) -> Dict[str, List[Dict[str, Any]]]:
 
-    return mta_result
+    # shops are fitted once for all models, on a process pool when workers > 1
+    fits = fit_shops(mta_data, tuple(models), workers=workers)
+    return {model: _model_result(model, fits, mta_data, budget) for model in models}
 
-def shapley_attribution(mta_data: Dict[str, Tuple[int, Any]], budget: Dict[str, float]) -> List[Dict[str, Any]]:
+def _model_result(model: str, fits: Dict[str, Any], mta_data: Dict[str, Tuple[int, Any]], budget: Dict[str, float]) -> List[Dict[str, Any]]:
 
+    # results keep the order of mta_data
     mta_result = []
     for shop_name in mta_data:
         shop_res = {}
         shop_res['shop'] = shop_name
-        models_results = {'model':'shapley', 'influence_percent':{}, 'conversion':{}}
+        models_results = {'model':model, 'influence_percent':{}, 'conversion':{}}
 
-        # errors and empty dataframes check
-        if mta_data[shop_name][0] == 0:
-            shop_res['data'] = models_results
-            mta_result.append(shop_res)
-            continue
-        try:
-            # mta calculation
-            mta = mta_.MTA(mta_data[shop_name][1])
-            mta.shapley()
-        except ZeroDivisionError:
+        # errors (ZeroDivisionError) and empty dataframes check
+        if fits.get(shop_name) is None:
             shop_res['data'] = models_results
             mta_result.append(shop_res)
             continue
-        values_shapley = list(mta.attribution['shapley'].values()) / np.sum(list(mta.attribution['shapley'].values()))
-        channels = mta.channels
-        for el in range(len(values_shapley)):
-            # add shapley
-            models_results['influence_percent'][channels[el]] = values_shapley[el]
-            models_results['conversion'][channels[el]] = values_shapley[el] * budget[shop_name]
+        values = fits[shop_name][model] / np.sum(fits[shop_name][model])
+        channels = fits[shop_name]['channels']
+        for el in range(len(values)):
+            models_results['influence_percent'][channels[el]] = values[el]
+            models_results['conversion'][channels[el]] = values[el] * budget[shop_name]
 
         shop_res['data'] = models_results
         mta_result.append(shop_res)
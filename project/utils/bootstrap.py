@@ -0,0 +1,282 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import mta_algorithms as mta_
+from utils.attribution import MODELS, heuristic_touches
+from utils.cube import PathCube
+
+METHODS = ['poisson', 'multinomial']
+
+
+def _path_matrix(paths: np.ndarray, columns: np.ndarray, weights: np.ndarray, shape: tuple) -> np.ndarray:
+    """
+    Args:
+        paths (np.ndarray): Row (path) of every entry.
+        columns (np.ndarray): Column of every entry.
+        weights (np.ndarray): Value of every entry, repeated entries are summed.
+        shape (tuple): Paths x columns.
+
+    Returns:
+        np.ndarray: Dense paths x columns matrix.
+    """
+    return np.bincount(paths * shape[1] + columns, weights=weights, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+class PathBootstrap:
+    """
+    Attribution of one shop's aggregated paths as a function of the number of converted and
+    non-converted journeys on every path.
+
+    Every model is linear in these counts up to its final normalization (Markov up to the solve of
+    the absorbing chain), so each one is kept as a paths x channels matrix (paths x transitions for
+    Markov) built once; attributing a batch of bootstrap replicates is then one matrix product per
+    model, plus one batched solve of the absorbing chains. Shapley values use their closed form: every
+    path gives each of its distinct channels the same share of its conversions (see
+    mta_.shapley_path_weights). The matrices hold paths x channels
+    entries, which suits source level attribution rather than thousands of ads.
+    """
+
+    def __init__(self,
+                 aggregated: pd.DataFrame,
+                 models: List[str] = MODELS,
+                 clean_paths: list = None,
+                 revenue: np.ndarray = None) -> None:
+        """
+        Args:
+            aggregated (pd.DataFrame): Aggregated paths of one shop (see aggregate_paths or
+                PathCube.aggregated): path, total_conversions, total_conversion_value, total_null.
+            models (list[str]): Any of MODELS.
+            clean_paths (list[list[str]]): Normalized path of every row for the heuristic models, the
+                channels of path if None.
+            revenue (np.ndarray): Order value of every row for the heuristic models,
+                total_conversion_value if None.
+        """
+        unknown = set(models) - set(MODELS)
+        if unknown:
+            raise ValueError(f"unknown attribution models: {sorted(unknown)}")
+
+        aggregated = aggregated.reset_index(drop=True)
+        self.models:      List[str] = list(models)
+        self.conversions: np.ndarray = aggregated['total_conversions'].to_numpy(dtype=float)
+        self.nulls:       np.ndarray = aggregated['total_null'].to_numpy(dtype=float)
+        self.values:      np.ndarray = aggregated['total_conversion_value'].to_numpy(dtype=float)
+        self.revenue:     np.ndarray = self.values if revenue is None else np.asarray(revenue, dtype=float)
+        self.channels:    Dict[str, list] = {}
+        self.matrices:    Dict[str, np.ndarray] = {}
+
+        # the paths as MTA sees them: loops collapsed, but one row per input row
+        store = mta_.JourneyStore.from_frame(aggregated, sep='>').collapse_loops(merge=False)
+        n_paths, n_channels = len(store), len(store.channel_names)
+
+        heuristics = [model for model in self.models if model not in ('markov', 'shapley')]
+        if heuristics:
+            paths = clean_paths if clean_paths is not None else [list(p) for p in store.to_frame()['path']]
+            # like heuristic_attribution, only paths with an order value are credited
+            rows = np.flatnonzero(self.revenue > 0)
+            touches, codes, channels, weights, credited = heuristic_touches([paths[r] for r in rows], heuristics)
+            for model in heuristics:
+                # share of a path's order value going to every channel the model reports
+                column = np.full(len(channels), -1)
+                column[credited[model]] = np.arange(len(credited[model]))
+                keep = column[codes] >= 0
+                self.matrices[model] = _path_matrix(rows[touches][keep], column[codes][keep], weights[model][keep],
+                                                    (n_paths, len(credited[model])))
+                self.channels[model] = list(channels[credited[model]])
+
+        if 'markov' in self.models:
+            # the same pair counts as MTA.transition_counts; states are (start), the channels, (conversion), (null)
+            n = n_channels + 3
+            touch = store.channels.astype(np.int64) + 1
+            first, last = store.offsets[:-1], store.offsets[1:] - 1
+            inner = np.ones(len(touch), dtype=bool)
+            inner[last] = False
+            # moves taken by all journeys of their path, then the final move into (conversion) or (null)
+            moves = np.concatenate([touch[first], touch[inner] * n + touch[np.flatnonzero(inner) + 1]])
+            move_paths = np.concatenate([np.arange(n_paths), store.path_index[inner]])
+            self.moves, move_ids = np.unique(np.concatenate([moves, touch[last] * n + n - 2, touch[last] * n + n - 1]),
+                                             return_inverse=True)
+            journey_ids, conversion_ids, null_ids = np.split(move_ids, [len(moves), len(moves) + n_paths])
+            journey_moves = _path_matrix(move_paths, journey_ids, np.ones(len(moves)), (n_paths, len(self.moves)))
+            self.n_states = n
+            self.matrices['markov'] = (
+                journey_moves + _path_matrix(np.arange(n_paths), conversion_ids, np.ones(n_paths), journey_moves.shape),
+                journey_moves + _path_matrix(np.arange(n_paths), null_ids, np.ones(n_paths), journey_moves.shape),
+            )
+            self.channels['markov'] = list(store.channel_names)
+
+        if 'shapley' in self.models:
+            members, offsets = store.distinct()
+            lengths = np.diff(offsets)
+            member_paths = np.repeat(np.arange(n_paths), lengths)
+            self.matrices['shapley'] = _path_matrix(member_paths, members.astype(np.int64),
+                                                    mta_.shapley_path_weights(lengths)[member_paths],
+                                                    (n_paths, n_channels))
+            self.channels['shapley'] = list(store.channel_names)
+
+    def __len__(self) -> int:
+        return len(self.conversions)
+
+    def attribute(self, conversions: np.ndarray, nulls: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Args:
+            conversions (np.ndarray): Converted journeys of every path, one row per replicate.
+            nulls (np.ndarray): Journeys without a conversion of every path, one row per replicate.
+
+        Returns:
+            dict: Model -> attributed revenue, one row per replicate and one column per channel of
+            self.channels[model]; NaN rows where a replicate has no conversions.
+        """
+        conversions, nulls = np.atleast_2d(conversions).astype(float), np.atleast_2d(nulls).astype(float)
+        # order values follow the conversions of their path (its journeys when it has none)
+        journeys = self.conversions + self.nulls
+        ratio = np.where(self.conversions > 0,
+                         conversions / np.where(self.conversions > 0, self.conversions, 1),
+                         (conversions + nulls) / np.where(journeys > 0, journeys, 1))
+        budget = ratio @ self.values
+
+        result = {}
+        for model in self.models:
+            if model == 'markov':
+                n = self.n_states
+                through_conversion, through_null = self.matrices['markov']
+                counts = np.zeros((len(conversions), n * n))
+                counts[:, self.moves] = conversions @ through_conversion + nulls @ through_null
+                p_conv, p_removed = mta_.absorbing_removal_probabilities(
+                    mta_.transition_probabilities(counts.reshape(-1, n, n)), start_idx=0, conv_idx=n - 2, null_idx=n - 1)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    credit = (p_conv[:, None] - p_removed[:, 1:n - 2]) / p_conv[:, None]
+
+            elif model == 'shapley':
+                credit = conversions @ self.matrices['shapley']
+
+            else:
+                result[model] = (ratio * self.revenue) @ self.matrices[model]
+                continue
+
+            # markov and shapley report shares of the shop's conversion value
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[model] = credit / credit.sum(axis=1, keepdims=True) * budget[:, None]
+
+        return result
+
+    def resample(self, n_replicates: int, method: str = 'poisson', rng=None) -> tuple:
+        """
+        Args:
+            n_replicates (int): Number of replicates.
+            method (str): poisson (every journey weighted by Poisson(1)) or multinomial (as many
+                journeys as observed, drawn with replacement).
+            rng: Seed or np.random.Generator.
+
+        Returns:
+            tuple: Converted and non-converted journeys of every path, one row per replicate.
+        """
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        rng = np.random.default_rng(rng)
+
+        # the cells are (path, converted) and (path, not converted); empty cells stay empty
+        cells = np.rint(np.concatenate([self.conversions, self.nulls])).astype(np.int64)
+        observed = np.flatnonzero(cells > 0)
+        counts = np.zeros((n_replicates, len(cells)))
+        if method == 'poisson':
+            counts[:, observed] = rng.poisson(cells[observed], size=(n_replicates, len(observed)))
+        else:
+            total = cells.sum()
+            counts[:, observed] = rng.multinomial(total, cells[observed] / max(total, 1), size=n_replicates)
+
+        return counts[:, :len(self)], counts[:, len(self):]
+
+
+def _replicate_batch(bootstrap: PathBootstrap, n_replicates: int, method: str, seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    return bootstrap.attribute(*bootstrap.resample(n_replicates, method, np.random.default_rng(seed)))
+
+
+def bootstrap_attribution(aggregated: pd.DataFrame,
+                          models: List[str] = MODELS,
+                          n_replicates: int = 200,
+                          method: str = 'poisson',
+                          alpha: float = 0.05,
+                          seed: int = 0,
+                          workers: int = 1,
+                          clean_paths: list = None,
+                          revenue: np.ndarray = None) -> Dict[str, pd.DataFrame]:
+    """
+    Bootstrap intervals of the attribution of one shop, resampling the journeys of its aggregated
+    path table instead of the raw journeys.
+
+    Replicates are drawn and attributed in batches (see PathBootstrap); with workers > 1 the batches
+    run on a process pool. Every batch has its own child seed, so the result depends on seed only.
+
+    Args:
+        aggregated (pd.DataFrame): Aggregated paths of one shop (see PathBootstrap).
+        models (list[str]): Any of MODELS.
+        n_replicates (int): Number of bootstrap replicates.
+        method (str): poisson or multinomial (see PathBootstrap.resample).
+        alpha (float): The intervals cover 1 - alpha.
+        seed (int): Seed of the replicates.
+        workers (int): Processes attributing batches of replicates in parallel.
+        clean_paths (list[list[str]]): Normalized paths for the heuristic models (see PathBootstrap).
+        revenue (np.ndarray): Order values for the heuristic models (see PathBootstrap).
+
+    Returns:
+        dict: Model -> DataFrame indexed by channel with the point estimate, lower and upper bounds
+        and the standard deviation of the attributed revenue over the replicates.
+    """
+    bootstrap = PathBootstrap(aggregated, models, clean_paths, revenue)
+    estimate = bootstrap.attribute(bootstrap.conversions, bootstrap.nulls)
+
+    # keep the replicate counts of a batch at around 2e6 entries
+    batch_size = max(1, int(2e6) // max(2 * len(bootstrap), 1))
+    sizes = [min(batch_size, n_replicates - begin) for begin in range(0, n_replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batches = list(pool.map(_replicate_batch, [bootstrap] * len(sizes), sizes, [method] * len(sizes), seeds))
+    else:
+        batches = [_replicate_batch(bootstrap, size, method, s) for size, s in zip(sizes, seeds)]
+
+    result = {}
+    for model in bootstrap.models:
+        replicates = np.vstack([batch[model] for batch in batches])
+        lower, upper = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        result[model] = pd.DataFrame({
+            'estimate': estimate[model][0],
+            'lower': lower,
+            'upper': upper,
+            'std': np.nanstd(replicates, axis=0),
+        }, index=pd.Index(bootstrap.channels[model], name='channel'))
+
+    return result
+
+
+def bootstrap_cube(cube: PathCube, start_date, end_date, models: List[str] = MODELS, **kwargs) -> Dict[str, pd.DataFrame]:
+    """
+    bootstrap_attribution for the journeys of a date range, with the same inputs as attribute_cube:
+    raw paths for Markov and Shapley, clean paths and order revenue for the heuristic models.
+
+    Args:
+        cube (PathCube): Cube of the shop.
+        start_date (datetime.date): First day (inclusive).
+        end_date (datetime.date): Last day (inclusive).
+        models (list[str]): Any of MODELS.
+        **kwargs: n_replicates, method, alpha, seed, workers (see bootstrap_attribution).
+
+    Returns:
+        dict: Model -> DataFrame indexed by channel with estimate, lower, upper and std.
+    """
+    totals = cube.totals(start_date, end_date)
+    keep = np.flatnonzero((totals['total_conversions'] > 0) | (totals['total_null'] > 0))
+    aggregated = pd.DataFrame({
+        'path': np.asarray(cube.paths, dtype=object)[keep],
+        'total_conversions': totals['total_conversions'][keep],
+        'total_conversion_value': totals['total_conversion_value'][keep],
+        'total_null': totals['total_null'][keep],
+    })
+
+    return bootstrap_attribution(aggregated, models,
+                                 clean_paths=[cube.clean_paths[p] for p in keep],
+                                 revenue=totals['revenue'][keep],
+                                 **kwargs)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import sys
+import types
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.attribution import attribute_all
+
+
+class LRUCache:
+    """
+    Bounded memo table between the dashboard and the computations it shows.
+
+    Keys are tuples starting with a dataset fingerprint followed by whatever selects the result
+    (shop, start_date, end_date, model, params). Least recently used results are evicted once more
+    than maxsize are stored or, with maxbytes set, once their estimated size (see sizeof) exceeds
+    maxbytes; the newest result is always kept, even when it is larger than maxbytes on its own.
+    """
+
+    def __init__(self, maxsize: int = 128, maxbytes: Optional[int] = None) -> None:
+        self.maxsize:  int = maxsize
+        self.maxbytes: Optional[int] = maxbytes
+        self.nbytes:   int = 0
+        self.hits:     int = 0
+        self.misses:   int = 0
+        self._data:    OrderedDict = OrderedDict()
+        self._sizes:   Dict[Hashable, int] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxbytes is not None:
+            size = sizeof(value)
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes and len(self._data) > 1):
+            evicted, _ = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(evicted, 0)
+
+    def get_or_compute(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Args:
+            key (tuple): Cache key.
+            fn (callable): Computes the value from args and kwargs on a miss.
+
+        Returns:
+            The cached or freshly computed value.
+        """
+        if key in self._data:
+            self.hits += 1
+            return self.get(key)
+        self.misses += 1
+        value = fn(*args, **kwargs)
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+
+def sizeof(value: Any, _seen: set = None) -> int:
+    """
+    Estimated memory held by a cached result: pandas objects with their object columns, numpy buffers,
+    and the contents of containers and plain objects (e.g. a fitted model), each object counted once.
+
+    Args:
+        value: Cached result.
+
+    Returns:
+        int: Size in bytes.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        # a view holds the array it was taken from
+        return value.nbytes if value.base is None else sizeof(value.base, _seen)
+
+    if isinstance(value, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+        return 0
+    if hasattr(value, 'to_plotly_json'):
+        # plotly figures: their data and layout, not the validators behind them
+        return sizeof(value.to_plotly_json(), _seen)
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(v, _seen) for v in value)
+    elif hasattr(value, '__dict__'):
+        size += sizeof(vars(value), _seen)
+    return size
+
+
+def bytes_fingerprint(content: bytes) -> str:
+    """
+    Args:
+        content (bytes): Raw dataset, e.g. an uploaded file.
+
+    Returns:
+        str: Content hash.
+    """
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def path_fingerprint(path: str) -> str:
+    """
+    Fingerprint of a file or of every file below a directory from names, sizes and modification
+    times, so the data itself is not read.
+
+    Args:
+        path (str): Dataset file or directory.
+
+    Returns:
+        str: Fingerprint that changes whenever a file is added, removed or rewritten.
+    """
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+    )
+    stats = [(f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files]
+    return hashlib.blake2b(repr(stats).encode(), digest_size=16).hexdigest()
+
+
+def attribute_cached(cache: LRUCache,
+                     key: Tuple,
+                     models: List[str],
+                     attribute: Callable = attribute_all,
+                     *args) -> Dict[str, Dict[str, float]]:
+    """
+    An attribution function through the cache, one entry per model; the models that are not cached yet
+    are computed together in one call.
+
+    Args:
+        cache (LRUCache): Cache to use.
+        key (tuple): Selects the data, e.g. (fingerprint, shop, start_date, end_date).
+        models (list[str]): Models to return.
+        attribute (callable): attribute_all or attribute_cube, called as attribute(*args, models).
+        *args: Data arguments of attribute, e.g. (data, shop) or (cube, start_date, end_date).
+
+    Returns:
+        dict: Model name -> {channel: attributed revenue}.
+    """
+    # cached results are taken (and refreshed) first, storing the missing ones may evict them
+    cached = {model: cache.get(key + (model,)) for model in models if key + (model,) in cache}
+    missing = [model for model in models if model not in cached]
+    computed = attribute(*args, missing) if missing else {}
+    for model, result in computed.items():
+        cache.put(key + (model,), result)
+    cache.misses += len(missing)
+    cache.hits += len(cached)
+
+    return {model: cached[model] if model in cached else computed[model] for model in models}
@@ -0,0 +1,164 @@
+import pandas as pd
+import numpy as np
+from itertools import chain
+from typing import Dict, List
+
+# canonical source names, in the order of the alias lists in names_sources.txt
+SOURCE_GROUPS = ['facebook', 'google', 'tiktok', 'snapchat', 'pinterest', 'klaviyo', 'email', 'influencer']
+
+# characters removed from raw sources before the alias lookup
+_STRIP = str.maketrans('', '', "\n()[]'")
+
+
+def load_source_aliases(names_sources_path: str = 'data/names_sources.txt') -> Dict[str, str]:
+    """
+    Parses names_sources.txt into a hashed alias -> canonical source map.
+
+    Args:
+        names_sources_path (str): ';'-separated alias lists, one per entry of SOURCE_GROUPS.
+
+    Returns:
+        dict: Alias -> canonical source name; an alias listed twice keeps its first group.
+    """
+    with open(names_sources_path, 'r') as f:
+        names_sources = f.read()
+
+    names_sources = list(map(lambda x: x.split(','),
+                                        names_sources.replace("'", '')
+                                                     .replace("]", '')
+                                                     .replace("[", '')
+                                                     .replace('"', '')
+                                                     .replace(' ', '')
+                                                     .split(';')))
+
+    aliases = {'': 'unset'}
+    for source, names in zip(SOURCE_GROUPS, names_sources):
+        for name in names:
+            aliases.setdefault(name, source)
+
+    return aliases
+
+
+class SourceNormalizer:
+    """
+    Maps raw tw_source values to canonical channel names.
+
+    Every distinct raw value is cleaned and looked up once and then served from a cache, so a batch
+    costs one factorize over its touches plus work proportional to the raw values not seen before.
+    """
+
+    def __init__(self, names_sources_path: str = 'data/names_sources.txt') -> None:
+        self.aliases: Dict[str, str] = load_source_aliases(names_sources_path)
+        self.cache:   Dict[str, str] = {}
+
+    def normalize(self, source: str) -> str:
+        """
+        Args:
+            source (str): Raw source.
+
+        Returns:
+            str: Canonical source, or the cleaned raw source if it has no alias.
+        """
+        if source not in self.cache:
+            clean = source.lower().translate(_STRIP)
+            self.cache[source] = self.aliases.get(clean, clean)
+        return self.cache[source]
+
+    def normalize_path(self, path: List[str]) -> List[str]:
+        return [self.normalize(source) for source in path]
+
+    def normalize_paths(self, paths: pd.Series) -> pd.Series:
+        """
+        Args:
+            paths (pd.Series): Customer journey paths (lists of raw sources).
+
+        Returns:
+            pd.Series: Cleaned paths with the same index.
+        """
+        if paths.empty:
+            return paths.copy()
+
+        lengths = paths.str.len().to_numpy()
+        codes, uniques = pd.factorize(pd.Series(list(chain.from_iterable(paths)), dtype=object))
+        cleaned = np.array([self.normalize(source) for source in uniques], dtype=object)[codes]
+
+        return pd.Series([list(path) for path in np.split(cleaned, np.cumsum(lengths)[:-1])],
+                         index=paths.index, dtype=object)
+
+
+class AdSourceTable:
+    """
+    (shop, ad id) -> source of the ads seen in the journeys, one entry per distinct ad.
+
+    Shops, ad ids and sources are coded as integers once per distinct value (spaces removed, as in the
+    ad ids of the mta channels); the table itself is a sorted array of (shop code, ad code) keys with
+    their source codes, so looking up many ads is a single searchsorted join.
+    """
+
+    def __init__(self) -> None:
+        self.shops:   Dict[str, int] = {}
+        self.ads:     Dict[str, int] = {}
+        self.sources: Dict[str, int] = {}
+        self.keys:    np.ndarray = np.empty(0, dtype=np.int64)
+        self.values:  np.ndarray = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def _codes(mapping: Dict[str, int], names, add: bool = True) -> np.ndarray:
+        """
+        Args:
+            mapping (dict): Name -> code, extended with new names if add.
+            names (array-like): Names to code.
+            add (bool): Give new names a code, otherwise they get -1.
+
+        Returns:
+            np.ndarray: Code of every name.
+        """
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        clean = [str(name).replace(' ', '') for name in uniques]
+        if add:
+            known = np.array([mapping.setdefault(name, len(mapping)) for name in clean], dtype=np.int64)
+        else:
+            known = np.array([mapping.get(name, -1) for name in clean], dtype=np.int64)
+        return known[codes] if len(codes) else np.empty(0, dtype=np.int64)
+
+    def update(self, shops, ads, sources) -> None:
+        """
+        Adds (shop, ad) -> source pairs; a pair seen again takes the latest source.
+
+        Args:
+            shops (array-like): Shop of every touch.
+            ads (array-like): Ad id of every touch.
+            sources (array-like): Source of every touch.
+        """
+        keys = self._codes(self.shops, shops) << 32 | self._codes(self.ads, ads)
+        values = self._codes(self.sources, sources)
+
+        # the last occurrence of a key wins, existing entries come first
+        keys, values = np.concatenate([self.keys, keys]), np.concatenate([self.values, values])
+        self.keys, last = np.unique(keys[::-1], return_index=True)
+        self.values = values[::-1][last]
+
+    def lookup(self, shop: str, ads) -> np.ndarray:
+        """
+        Args:
+            shop (str): Shop name.
+            ads (array-like): Ad ids of the shop.
+
+        Returns:
+            np.ndarray: Source of every ad.
+
+        Raises:
+            KeyError: For an ad that was never seen with the shop.
+        """
+        ads = np.asarray(ads, dtype=object)
+        keys = self._codes(self.shops, [shop] * len(ads), add=False) << 32 | self._codes(self.ads, ads, add=False)
+        position = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = (keys >= 0) & (len(self.keys) > 0)
+        found[found] = self.keys[position[found]] == keys[found]
+        if not found.all():
+            raise KeyError(f'{shop}{ads[~found][0]}')
+
+        return np.array(list(self.sources), dtype=object)[self.values[position]]
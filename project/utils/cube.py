@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# per (day, path) measures kept in the cube; revenue is the order value of all orders with a positive
+# total_price (what the heuristic models distribute), total_conversion_value only counts successful journeys
+MEASURES = ['total_conversions', 'total_conversion_value', 'total_null', 'revenue']
+
+
+class PathCube:
+    """
+    Daily path counts of one shop with prefix sums over days, stored sparse by path.
+
+    Only the (path, day) cells with journeys are kept: cells holds path * len(days) + day for each of
+    them in sorted order, so the days of every path are a sorted run, and cumulative[measure][i] is the
+    measure summed over the first i cells. The totals of path p over a date range are then the
+    difference of cumulative at the two positions where the range's first and past-the-end day of p
+    would be inserted (one searchsorted for all paths), and no journeys are read again when the range
+    changes. Memory grows with the cells that hold journeys, not with days x paths. Paths are the raw
+    tw_source paths (what the Markov and Shapley models aggregate); clean_paths holds the
+    tw_source_clean path of each of them for the heuristic models.
+    """
+
+    def __init__(self,
+                 shop: str,
+                 days: np.ndarray,
+                 paths: List[str],
+                 clean_paths: List[List[str]],
+                 cells: np.ndarray,
+                 cumulative: Dict[str, np.ndarray]) -> None:
+        self.shop:        str = shop
+        self.days:        np.ndarray = days
+        self.paths:       List[str] = paths
+        self.clean_paths: List[List[str]] = clean_paths
+        self.cells:       np.ndarray = cells
+        self.cumulative:  Dict[str, np.ndarray] = cumulative
+
+    @classmethod
+    def from_journeys(cls, data: pd.DataFrame, shop: str) -> "PathCube":
+        """
+        Args:
+            data (pd.DataFrame): Journeys with shop_name, journey_end_ts, tw_source, tw_source_clean,
+                journey_success and total_price.
+            shop (str): Shop name.
+
+        Returns:
+            PathCube: Cube of the shop's journeys.
+        """
+        data = data[data['shop_name'] == shop]
+
+        day = pd.to_datetime(data['journey_end_ts']).to_numpy().astype('datetime64[D]')
+        days, day_idx = np.unique(day, return_inverse=True)
+        path_idx, paths = pd.factorize(data['tw_source'].map('>'.join).to_numpy())
+        # a raw path always normalizes to the same clean path, take the first journey of each
+        first = np.unique(path_idx, return_index=True)[1]
+        clean_paths = list(data['tw_source_clean'].to_numpy()[first])
+
+        success = (data['journey_success'] == 1).to_numpy()
+        price = data['total_price'].to_numpy(dtype=float)
+        weights = {
+            'total_conversions': success,
+            'total_conversion_value': np.where(success, price, 0.0),
+            'total_null': (data['journey_success'] == 0).to_numpy(),
+            'revenue': np.where(price > 0, price, 0.0),
+        }
+
+        # sorted (path, day) cells with journeys and prefix sums over them, cumulative[0] is zero
+        cells, cell_idx = np.unique(path_idx.astype(np.int64) * len(days) + day_idx.ravel(), return_inverse=True)
+        cumulative = {}
+        for measure in MEASURES:
+            daily = np.bincount(cell_idx.ravel(), weights=weights[measure], minlength=len(cells))
+            dtype = np.int64 if measure in ('total_conversions', 'total_null') else float
+            cumulative[measure] = np.concatenate([[0], np.cumsum(daily.astype(dtype))]).astype(dtype)
+
+        return cls(shop, days, list(paths), clean_paths, cells, cumulative)
+
+    def _rows(self, start_date=None, end_date=None) -> Tuple[int, int]:
+        start = 0 if start_date is None else np.searchsorted(self.days, np.datetime64(start_date, 'D'), 'left')
+        end = len(self.days) if end_date is None else np.searchsorted(self.days, np.datetime64(end_date, 'D'), 'right')
+        return start, max(start, end)
+
+    def totals(self, start_date=None, end_date=None) -> Dict[str, np.ndarray]:
+        """
+        Args:
+            start_date (datetime.date): First day (inclusive), unbounded if None.
+            end_date (datetime.date): Last day (inclusive), unbounded if None.
+
+        Returns:
+            dict: Measure -> per path totals over the range.
+        """
+        start, end = self._rows(start_date, end_date)
+        # first cell of every path on or after the start day and on or after the end day
+        base = np.arange(len(self.paths), dtype=np.int64) * len(self.days)
+        first = np.searchsorted(self.cells, base + start, 'left')
+        past = np.searchsorted(self.cells, base + end, 'left')
+        return {measure: c[past] - c[first] for measure, c in self.cumulative.items()}
+
+    def aggregated(self, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Same frame as aggregate_paths would return for the shop's journeys in the range.
+
+        Args:
+            start_date (datetime.date): First day (inclusive), unbounded if None.
+            end_date (datetime.date): Last day (inclusive), unbounded if None.
+
+        Returns:
+            pd.DataFrame: shop_name, path, total_conversions, total_conversion_value, total_null.
+        """
+        totals = self.totals(start_date, end_date)
+        keep = np.flatnonzero((totals['total_conversions'] > 0) | (totals['total_null'] > 0))
+        return pd.DataFrame({
+            'shop_name': self.shop,
+            'path': np.asarray(self.paths, dtype=object)[keep],
+            'total_conversions': totals['total_conversions'][keep],
+            'total_conversion_value': totals['total_conversion_value'][keep],
+            'total_null': totals['total_null'][keep],
+        })
+
+    def revenue_paths(self, start_date=None, end_date=None) -> Tuple[List[List[str]], np.ndarray]:
+        """
+        Args:
+            start_date (datetime.date): First day (inclusive), unbounded if None.
+            end_date (datetime.date): Last day (inclusive), unbounded if None.
+
+        Returns:
+            tuple: Clean paths with revenue in the range and their revenue.
+        """
+        revenue = self.totals(start_date, end_date)['revenue']
+        keep = np.flatnonzero(revenue > 0)
+        return [self.clean_paths[p] for p in keep], revenue[keep]
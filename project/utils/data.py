@@ -1,96 +1,108 @@
 import pandas as pd
+import numpy as np
 import ast
 from typing import List, Dict, Tuple
+from utils.channels import SourceNormalizer
 
-def prep_data_for_markov_shapley(data, mta_level:  str='source') -> Tuple[Dict[str, Tuple[int, pd.DataFrame]], Dict[str, float]]:
+def aggregate_paths(data: pd.DataFrame, mta_level: str = 'source', path_ids: bool = False) -> pd.DataFrame:
     """
+    Aggregates journeys per (shop, path) in one hashed group-by.
+
     Args:
-        mta_level (str):            - source or adid
+        data (pd.DataFrame): Journeys with shop_name, tw_{mta_level}, journey_success and total_price.
+        mta_level (str): source or adid.
+        path_ids (bool): Also return an integer path_id per distinct path (shared across shops).
+
     Returns:
-        mta_data (pd.DataFrame):    - data for mta
+        pd.DataFrame: shop_name, path (joined with '>'), total_conversions, total_conversion_value,
+        total_null and optionally path_id, paths in order of first appearance.
+    """
+    success = (data['journey_success'] == 1).to_numpy()
+    aggregated = pd.DataFrame({
+        'shop_name': data['shop_name'].to_numpy(),
+        # make a string path with > delimeter. Ex: facebook>google>facebook
+        'path': data[f'tw_{mta_level}'].map('>'.join).to_numpy(),
+        'total_conversions': success.astype(int),
+        'total_conversion_value': np.where(success, data['total_price'].to_numpy(dtype=float), 0.0),
+        'total_null': (data['journey_success'] == 0).to_numpy().astype(int),
+    }).groupby(['shop_name', 'path'], sort=False).sum().reset_index()
+
+    if path_ids:
+        aggregated['path_id'] = pd.factorize(aggregated['path'])[0]
+
+    return aggregated
+
+
+def merge_aggregates(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combines partial outputs of aggregate_paths (e.g. of chunks of journeys) into one.
+
+    Args:
+        frames (list[pd.DataFrame]): Outputs of aggregate_paths without path_id.
+
+    Returns:
+        pd.DataFrame: Same columns, one row per (shop, path), paths in order of first appearance.
+    """
+    return pd.concat(frames, ignore_index=True).groupby(['shop_name', 'path'], sort=False).sum().reset_index()
+
+
+def push_aggregate(stack: List[Tuple[int, pd.DataFrame]], partial: pd.DataFrame) -> None:
+    """
+    Adds the next partial output of aggregate_paths to a running merge. Like a binary counter, two
+    neighbours are merged as soon as they stand for the same number of partials, so every row is merged
+    O(log partials) times (instead of once per partial when folding into one running aggregate) and the
+    stack holds at most log2(partials) + 1 frames; merge_aggregates of the stack's frames is the result.
+
+    Args:
+        stack (list): (number of partials, merged partials) in the order they were pushed, changed in place.
+        partial (pd.DataFrame): Output of aggregate_paths without path_id.
+    """
+    stack.append((1, partial))
+    while len(stack) > 1 and stack[-1][0] == stack[-2][0]:
+        (count, left), (_, right) = stack[-2:]
+        stack[-2:] = [(2 * count, merge_aggregates([left, right]))]
+
+
+def split_by_shop(aggregated: pd.DataFrame) -> Tuple[Dict[str, Tuple[int, pd.DataFrame]], Dict[str, float]]:
+    """
+    Args:
+        aggregated (pd.DataFrame): Output of aggregate_paths.
+
+    Returns:
+        tuple: {shop: (number of paths, data for mta)} and {shop: total conversion value}, shops in
+        sorted order whatever order the source returned them in.
     """
-    budget = {}
-    # make a string path with > delimeter. Ex: facebook>google>facebook
-    data[f'path'] = data[f'tw_{mta_level}'].apply(lambda x: '>'.join(x))
-    # for each shop from dataframe prepare dataset
     mta_data_shops = {}
-    for shop in data.shop_name.unique():
-        total_conv = {}
-        data_shop = data[data.shop_name == shop]
-        # for each unique path calculate its conversion and lost customers
-        for el in data_shop['path'].unique():
-            data_path = data_shop[data_shop['path'] == el]
-            tot_conv = data_path[data_path.journey_success == 1].shape[0]
-            total_conversion_value = data_path[data_path.journey_success == 1].total_price.sum()
-            tot_null = data_path[data_path.journey_success == 0].shape[0]
-            total_conv[el] = {'total_conversions': tot_conv,
-                               'total_conversion_value': total_conversion_value,
-                               'total_null': tot_null}
-        mta_data = pd.DataFrame(total_conv).T.reset_index().rename(columns={'index':'path'})
+    budget = {}
+    for shop, mta_data in aggregated.groupby('shop_name', sort=True):
+        mta_data = mta_data.drop(columns=['shop_name', 'path_id'], errors='ignore').reset_index(drop=True)
         mta_data_shops[f'{shop}'] = mta_data.shape[0], mta_data
         # calculate total budget for each shop
         budget[f'{shop}'] = mta_data['total_conversion_value'].sum()
 
     return mta_data_shops, budget
 
+
+def prep_data_for_markov_shapley(data, mta_level:  str='source') -> Tuple[Dict[str, Tuple[int, pd.DataFrame]], Dict[str, float]]:
+    """
+    Args:
+        mta_level (str):            - source or adid
+    Returns:
+        mta_data (pd.DataFrame):    - data for mta
+    """
+    return split_by_shop(aggregate_paths(data, mta_level))
+
 def prepare_data(data:pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
-    names_sources = open('data/names_sources.txt', "r")
-    names_sources = names_sources.read()
-    names_sources = list(map(lambda x: x.split(','),
-                                                    names_sources.replace("'", '')
-                                                                    .replace("]", '')
-                                                                    .replace("[", '')
-                                                                    .replace('"', '')
-                                                                    .replace(' ', '')
-                                                                    .split(';')))
-
-    FB_LIST, GOOGLE_LIST, TIKTOK_LIST, SNAPCHAT_LIST, PINTEREST_LIST, KLAVIYO_LIST, EMAIL_LIST, INFLUENCER_LIST = names_sources
-
-    KLAVIYO_LIST.append('kl')
-
-    def clean_data(path: List[str]) -> List[str]:
-        """
-        Cleans customer journey paths.
-
-        Args:
-            path (list[str]): Customer journey path (only sources).
-
-        Returns:
-            list[str]: Cleaned customer journey path.
-        """
-        new_path = []
-        for source in path:
-            source = source.lower().replace("\n", '').replace("(", '').replace(")", '')
-            source = source.replace("[", '').replace("]", '').replace("'", '')
-            if source in FB_LIST:
-                source = 'facebook'
-            elif source in GOOGLE_LIST:
-                source = 'google'
-            elif source in TIKTOK_LIST:
-                source = 'tiktok'
-            elif source in SNAPCHAT_LIST:
-                source = 'snapchat'
-            elif source in PINTEREST_LIST:
-                source = 'pinterest'
-            elif source in KLAVIYO_LIST:
-                source = 'klaviyo'
-            elif source in EMAIL_LIST:
-                source = 'email'
-            elif source in INFLUENCER_LIST:
-                source = 'influencer'
-            elif source == '':
-                source = 'unset'
-            new_path.append(source)
-        return new_path
+    sources = SourceNormalizer('data/names_sources.txt')
 
     # data['tw_source'] = data['tw_source'].apply(lambda x: ast.literal_eval(x))
 
     data_shop_1 = data[data['shop_name'] == 'beauty_shop_1']
     data_shop_2 = data[data['shop_name'] == 'beauty_shop_2']
 
-    data_shop_1['tw_source_clean'] = data_shop_1['tw_source'].apply(clean_data)
-    data_shop_2['tw_source_clean'] = data_shop_2['tw_source'].apply(clean_data)
+    data_shop_1['tw_source_clean'] = sources.normalize_paths(data_shop_1['tw_source'])
+    data_shop_2['tw_source_clean'] = sources.normalize_paths(data_shop_2['tw_source'])
 
     data_shop_1['total_price'] = data_shop_1['total_price'].astype(float)
     data_shop_2['total_price'] = data_shop_2['total_price'].astype(float)
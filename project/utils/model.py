@@ -1,6 +1,18 @@
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.linear_model import LinearRegression
-from typing import Tuple
+from typing import Dict, List, Tuple
+
+# daily spend columns of final_final_mmm.csv
+MMM_CHANNELS = ['facebook-ads', 'google-ads', 'tiktok-ads', 'pinterest-ads', 'snapchat-ads', 'amazon']
+# hyperparameter grid searched per channel; half saturation is relative to the channel's mean adstocked spend
+DECAYS = np.linspace(0.0, 0.9, 10)
+HALF_SATURATIONS = np.array([0.25, 0.5, 1.0, 2.0, 4.0])
+SLOPES = np.array([0.5, 1.0, 2.0])
+# ridge penalties searched with them (saturated spend is in [0, 1))
+ALPHAS = np.array([0.001, 0.01, 0.1, 1.0])
+
 
 def train_mmm_model(data_mmm: pd.DataFrame, shop_name: str = 'beauty_shop_1') -> Tuple[LinearRegression, pd.DataFrame, pd.Series]:
     data_test = data_mmm[data_mmm['provider_account'] == shop_name] \
@@ -14,5 +26,296 @@ def train_mmm_model(data_mmm: pd.DataFrame, shop_name: str = 'beauty_shop_1') ->
     return lr, X, y
 
 
+def geometric_adstock(spend: np.ndarray, decays: np.ndarray) -> np.ndarray:
+    """
+    Carryover of spend: x[t] = sum_k decay^k spend[t - k], normalized by the kernel sum so that
+    adstocked spend stays in spend units.
+
+    All decays are applied at once as one batched convolution over time (FFT), exact for the whole
+    series.
+
+    Args:
+        spend (np.ndarray): Days x channels.
+        decays (np.ndarray): Decay rates in [0, 1).
+
+    Returns:
+        np.ndarray: Decays x days x channels.
+    """
+    spend = np.asarray(spend, dtype=float)
+    decays = np.asarray(decays, dtype=float)
+    days = spend.shape[0]
+    n_fft = 2 * days
+
+    kernels = decays[:, None] ** np.arange(days)[None, :]
+    kernels /= kernels.sum(axis=1, keepdims=True)
+
+    transformed = np.fft.rfft(kernels, n=n_fft, axis=1)[:, :, None] * np.fft.rfft(spend, n=n_fft, axis=0)[None, :, :]
+    # the FFT leaves rounding noise around zero where there is no spend
+    return np.clip(np.fft.irfft(transformed, n=n_fft, axis=1)[:, :days, :], 0, None)
+
+
+def hill_saturation(x: np.ndarray, half_saturation, slope) -> np.ndarray:
+    """
+    Diminishing returns: x^slope / (x^slope + half_saturation^slope), 0.5 at x = half_saturation.
+
+    Args:
+        x (np.ndarray): Non-negative (adstocked) spend.
+        half_saturation (array-like): Spend at half of the maximum effect, broadcast against x.
+        slope (array-like): Hill coefficient, broadcast against x.
+
+    Returns:
+        np.ndarray: Response in [0, 1).
+    """
+    xs = np.power(x, slope)
+    return xs / (xs + np.power(half_saturation, slope))
+
+
+def ridge_fit(X: np.ndarray,
+              y: np.ndarray,
+              alpha: float = 1.0,
+              rows: np.ndarray = None,
+              positive: bool = False,
+              tol: float = 1e-8,
+              max_iter: int = 1000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ridge regression with an unpenalized intercept, for a whole stack of design matrices.
+
+    Centering takes the intercept out of the problem, so the coefficients minimize
+    b' G b / 2 - h' b with G = Xc' Xc + alpha I and h = Xc' yc. Without constraints that is one batched
+    solve. With positive=True the coefficients are kept non-negative: candidates whose unconstrained
+    solution already is are done, the rest go through cyclic coordinate descent on the same quadratic
+    (b_j = max(0, (h_j - sum_{k != j} G_jk b_k) / G_jj)), all of them at once, until no coefficient
+    moves by more than tol relative to the largest one.
+
+    Args:
+        X (np.ndarray): Candidates x days x features (or days x features).
+        y (np.ndarray): Target per day.
+        alpha (float or np.ndarray): L2 penalty, or one per candidate.
+        rows (np.ndarray): Boolean mask of the days to fit on, all if None.
+        positive (bool): Constrain the coefficients to be non-negative.
+        tol (float): Convergence tolerance of the coordinate descent.
+        max_iter (int): Coordinate descent sweeps at most.
+
+    Returns:
+        tuple: Coefficients (candidates x features) and intercepts (candidates).
+    """
+    if rows is None:
+        rows = np.ones(X.shape[-2], dtype=bool)
+    X, y = X[..., rows, :], np.asarray(y, dtype=float)[rows]
+
+    x_mean = X.mean(axis=-2, keepdims=True)
+    Xc, yc = X - x_mean, y - y.mean()
+    gram = np.swapaxes(Xc, -1, -2) @ Xc + np.asarray(alpha, dtype=float)[..., None, None] * np.eye(X.shape[-1])
+    target = np.swapaxes(Xc, -1, -2) @ yc
+    coef = np.linalg.solve(gram, target[..., None])[..., 0]
+
+    if positive:
+        # candidates x features from here on, whatever the leading dimensions
+        shape, candidates = coef.shape, int(np.prod(coef.shape[:-1]))
+        gram, target = gram.reshape(candidates, *gram.shape[-2:]), target.reshape(candidates, shape[-1])
+        coef = coef.reshape(candidates, shape[-1])
+        todo = np.flatnonzero((coef < 0).any(axis=1))
+        b = np.clip(coef[todo], 0, None)
+        for _ in range(max_iter):
+            if not len(todo):
+                break
+            g, h, previous = gram[todo], target[todo], b.copy()
+            for j in range(b.shape[1]):
+                b[:, j] = np.maximum(0.0, b[:, j] + (h[:, j] - (g[:, j, :] * b).sum(axis=1)) / g[:, j, j])
+            coef[todo] = b
+            moving = np.abs(b - previous).max(axis=1) > tol * np.maximum(np.abs(b).max(axis=1), 1e-12)
+            todo, b = todo[moving], b[moving]
+        coef = coef.reshape(shape)
+
+    return coef, y.mean() - (x_mean[..., 0, :] * coef).sum(axis=-1)
+
+
+class MediaMixModel:
+    """
+    Daily revenue as a base plus one adstocked, saturated response per channel.
+
+    Every channel gets its own decay, half saturation and slope. The search evaluates the full grid of
+    one channel at a time (the others fixed at their current best), with every ridge penalty, as one
+    stack of ridge fits scored on the last days, and repeats over the channels until no choice changes; the transformed spend of all
+    candidates is computed once up front. Spend can only add revenue, so the channel coefficients are
+    kept non-negative (see ridge_fit).
+    """
+
+    def __init__(self,
+                 shop: str,
+                 channels: List[str],
+                 dates: pd.Index,
+                 spend: np.ndarray,
+                 revenue: np.ndarray,
+                 decay: np.ndarray,
+                 half_saturation: np.ndarray,
+                 slope: np.ndarray,
+                 coef: np.ndarray,
+                 intercept: float,
+                 alpha: float,
+                 validation_error: float) -> None:
+        self.shop:             str = shop
+        self.channels:         List[str] = channels
+        self.dates:            pd.Index = dates
+        self.spend:            np.ndarray = spend
+        self.revenue:          np.ndarray = revenue
+        self.decay:            np.ndarray = decay
+        self.half_saturation:  np.ndarray = half_saturation
+        self.slope:            np.ndarray = slope
+        self.coef:             np.ndarray = coef
+        self.intercept:        float = intercept
+        self.alpha:            float = alpha
+        self.validation_error: float = validation_error
+
+    @classmethod
+    def fit(cls,
+            data_mmm: pd.DataFrame,
+            shop_name: str = 'beauty_shop_1',
+            channels: List[str] = MMM_CHANNELS,
+            alphas: np.ndarray = ALPHAS,
+            decays: np.ndarray = DECAYS,
+            half_saturations: np.ndarray = HALF_SATURATIONS,
+            slopes: np.ndarray = SLOPES,
+            validation_share: float = 0.2,
+            max_rounds: int = 5) -> "MediaMixModel":
+        """
+        Args:
+            data_mmm (pd.DataFrame): Daily spend and revenue as in final_final_mmm.csv (event_date,
+                provider_account, total_price_usd and the channel columns).
+            shop_name (str): Shop name.
+            channels (list[str]): Spend columns.
+            alphas (np.ndarray): Ridge penalties to search.
+            decays (np.ndarray): Adstock decays to search.
+            half_saturations (np.ndarray): Half saturation points to search, relative to the mean
+                positive adstocked spend of the channel.
+            slopes (np.ndarray): Hill slopes to search.
+            validation_share (float): Share of the last days the candidates are scored on.
+            max_rounds (int): Passes over the channels at most.
+
+        Returns:
+            MediaMixModel: Model with the best hyperparameters refitted on all days.
+        """
+        data = data_mmm[data_mmm['provider_account'] == shop_name].sort_values('event_date')
+        spend = data[channels].to_numpy(dtype=float)
+        revenue = data['total_price_usd'].to_numpy(dtype=float)
+        days, n_channels = spend.shape
+
+        # decays x days x channels, then every (decay, half, slope) candidate: candidates x days x channels
+        adstocked = geometric_adstock(spend, decays)
+        # mean adstocked spend on the days with any, per decay and channel (1 for channels never used)
+        active = (adstocked > 0).sum(axis=1)
+        scale = np.where(active > 0, adstocked.sum(axis=1) / np.maximum(active, 1), 1.0)
+        half = half_saturations[None, :, None] * scale[:, None, :]
+        grid = np.stack(np.meshgrid(np.arange(len(decays)), np.arange(len(half_saturations)), np.arange(len(slopes)),
+                                    indexing='ij'), axis=-1).reshape(-1, 3)
+        features = hill_saturation(adstocked[:, None, None, :, :],
+                                   half[:, :, None, None, :],
+                                   slopes[None, None, :, None, None]).reshape(len(grid), days, n_channels)
+
+        train = np.arange(days) < days - max(1, int(days * validation_share))
+
+        def validation_errors(X: np.ndarray, penalties: np.ndarray) -> np.ndarray:
+            # mean squared error on the validation days of a stack of fits on the training days
+            coef, intercept = ridge_fit(X, revenue, penalties, train, positive=True)
+            residual = revenue[~train] - (X[:, ~train, :] @ coef[..., None])[..., 0] - intercept[:, None]
+            return np.mean(residual ** 2, axis=1)
+
+        alphas = np.asarray(alphas, dtype=float)
+        choice, alpha = np.full(n_channels, len(grid) // 2), len(alphas) // 2
+        for _ in range(max_rounds):
+            changed = False
+            for c in range(n_channels):
+                # all candidates of channel c next to the current choice for the others, with every penalty
+                X = np.repeat(features[choice, :, np.arange(n_channels)].T[None], len(grid), axis=0)
+                X[:, :, c] = features[:, :, c]
+                X = np.repeat(X, len(alphas), axis=0)
+                penalties = np.tile(alphas, len(grid))
+                errors = validation_errors(X, penalties)
+                best, current = int(np.argmin(errors)), choice[c] * len(alphas) + alpha
+                if errors[best] < errors[current]:
+                    (choice[c], alpha), changed = divmod(best, len(alphas)), True
+            if not changed:
+                break
+
+        X = features[choice, :, np.arange(n_channels)].T.reshape(days, n_channels)
+        error = validation_errors(X[None], alphas[[alpha]])[0]
+        coef, intercept = ridge_fit(X, revenue, alphas[alpha], positive=True)
+
+        return cls(shop=shop_name,
+                   channels=list(channels),
+                   dates=pd.Index(data['event_date'], name='event_date'),
+                   spend=spend,
+                   revenue=revenue,
+                   decay=decays[grid[choice, 0]],
+                   half_saturation=half_saturations[grid[choice, 1]] * scale[grid[choice, 0], np.arange(n_channels)],
+                   slope=slopes[grid[choice, 2]],
+                   coef=coef,
+                   intercept=float(intercept),
+                   alpha=float(alphas[alpha]),
+                   validation_error=float(np.sqrt(error)))
+
+    def transform(self, spend: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            spend (np.ndarray): Days x channels.
+
+        Returns:
+            np.ndarray: Saturated adstocked spend, days x channels.
+        """
+        adstocked = np.stack([geometric_adstock(spend[:, [c]], [d])[0, :, 0] for c, d in enumerate(self.decay)], axis=1)
+        return hill_saturation(adstocked, self.half_saturation, self.slope)
+
+    def contributions(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: Revenue attributed to every channel and to the base per day; the rows sum to
+            the fitted revenue.
+        """
+        contributions = pd.DataFrame(self.transform(self.spend) * self.coef, index=self.dates, columns=self.channels)
+        return contributions.assign(Base=self.intercept)
+
+    def predict(self, spend: np.ndarray = None) -> np.ndarray:
+        """
+        Args:
+            spend (np.ndarray): Days x channels, the training spend if None.
+
+        Returns:
+            np.ndarray: Revenue per day.
+        """
+        spend = self.spend if spend is None else np.asarray(spend, dtype=float)
+        return self.transform(spend) @ self.coef + self.intercept
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: Hyperparameters, coefficient and total contribution per channel.
+        """
+        return pd.DataFrame({
+            'decay': self.decay,
+            'half_saturation': self.half_saturation,
+            'slope': self.slope,
+            'coef': self.coef,
+            'contribution': self.contributions()[self.channels].sum().to_numpy(),
+        }, index=pd.Index(self.channels, name='channel'))
+
+
+def fit_mmm_shops(data_mmm: pd.DataFrame, shops: List[str] = None, workers: int = 1, **kwargs) -> Dict[str, MediaMixModel]:
+    """
+    Args:
+        data_mmm (pd.DataFrame): Daily spend and revenue of all shops.
+        shops (list[str]): Shops to fit, all of data_mmm if None.
+        workers (int): Processes fitting the shops in parallel.
+        **kwargs: Passed on to MediaMixModel.fit.
+
+    Returns:
+        dict: Shop -> MediaMixModel, in the order of shops.
+    """
+    shops = list(data_mmm['provider_account'].unique()) if shops is None else list(shops)
+    frames = [data_mmm[data_mmm['provider_account'] == shop] for shop in shops]
 
+    if workers <= 1 or len(shops) < 2:
+        return {shop: MediaMixModel.fit(frame, shop, **kwargs) for shop, frame in zip(shops, frames)}
 
+    with ProcessPoolExecutor(max_workers=min(workers, len(shops))) as pool:
+        futures = [pool.submit(MediaMixModel.fit, frame, shop, **kwargs) for shop, frame in zip(shops, frames)]
+        return {shop: future.result() for shop, future in zip(shops, futures)}
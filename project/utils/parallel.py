@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import mta_algorithms as mta_
+
+
+def fit_shop(mta_data: pd.DataFrame,
+             models: Tuple[str, ...] = ('markov', 'shapley')) -> Optional[Dict[str, Any]]:
+    """
+    Fits the models of one shop, runs inside a worker.
+
+    Args:
+        mta_data (pd.DataFrame): Aggregated paths of the shop (see aggregate_paths).
+        models (tuple[str]): markov and/or shapley.
+
+    Returns:
+        dict: channels and one array of raw attribution values per model, None when the shop has no
+        conversions (ZeroDivisionError).
+    """
+    try:
+        mta = mta_.MTA(mta_data)
+        if 'markov' in models:
+            mta.markov()
+        if 'shapley' in models:
+            mta.shapley()
+    except ZeroDivisionError:
+        return None
+
+    result = {'channels': mta.channels}
+    for model in models:
+        result[model] = np.array(list(mta.attribution[model].values()), dtype=float)
+    return result
+
+
+def fit_shops(mta_data: Dict[str, Tuple[int, pd.DataFrame]],
+              models: Tuple[str, ...] = ('markov', 'shapley'),
+              workers: int = 1) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fits the models of every shop, on a process pool when workers > 1.
+
+    Workers receive the aggregated path table only (one '>'-joined string and three numbers per
+    distinct path) and build the integer-coded journeys themselves, so nothing but the submission is
+    sequential. Larger shops are submitted first so that one big shop does not end up last on a busy
+    pool; the result follows the order of mta_data whatever order the workers finish in.
+
+    Args:
+        mta_data (dict): {shop: (number of paths, aggregated paths)} as returned by split_by_shop.
+        models (tuple[str]): markov and/or shapley.
+        workers (int): Number of processes, 1 runs in the current process.
+
+    Returns:
+        dict: {shop: fit_shop result} for the shops with at least one path.
+    """
+    shops: List[str] = [shop for shop in mta_data if mta_data[shop][0] != 0]
+    fit = partial(fit_shop, models=tuple(models))
+
+    if workers <= 1 or len(shops) <= 1:
+        return {shop: fit(mta_data[shop][1]) for shop in shops}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            shop: pool.submit(fit, mta_data[shop][1])
+            for shop in sorted(shops, key=lambda shop: mta_data[shop][0], reverse=True)
+        }
+        return {shop: futures[shop].result() for shop in shops}
@@ -0,0 +1,100 @@
+import ast
+import logging
+import re
+from itertools import chain
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# serialized lists as exported by the warehouse: ['facebook', 'google'] or [12.5, 3] - quoted strings
+# without escapes and plain numbers only, everything else goes through ast.literal_eval
+# (a number splits its digits one way only, so a failed match cannot backtrack over them)
+_ITEM = r"""'[^'\\\n\x1e]*'|"[^"\\\n\x1e]*"|[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?"""
+_LIST = rf"\s*\[\s*(?:(?:{_ITEM})\s*(?:,\s*(?:{_ITEM})\s*)*,?\s*)?\]\s*"
+# valid rows are joined with a record separator so that the column is tokenized in one scan
+_SEP = '\x1e'
+_ROW = re.compile(_LIST)
+_TOKEN = re.compile(rf"{_ITEM}|{_SEP}")
+
+
+def parse_lists(serialized: pd.Series) -> Tuple[pd.Series, np.ndarray]:
+    """
+    Parses a column of serialized lists in bulk.
+
+    Rows matching the restricted list grammar are validated with one regex per row, tokenized together
+    and their tokens are converted for the whole column at once; other strings fall back to ast.literal_eval and values
+    that already are lists pass through. Rows that are not a list (bad syntax, NaN, a scalar) are
+    reported instead of raising.
+
+    Args:
+        serialized (pd.Series): Serialized lists, e.g. tw_source as read from a CSV or the warehouse.
+
+    Returns:
+        tuple: Series of lists with the same index (None for malformed rows) and the positions of the
+        malformed rows.
+    """
+    result = [None] * len(serialized)
+    kind = [type(x) for x in serialized]
+    is_str = np.array([k is str for k in kind], dtype=bool)
+    is_list = np.array([k in (list, tuple, np.ndarray) for k in kind], dtype=bool)
+
+    strings = serialized[is_str].reset_index(drop=True)
+    string_pos = np.flatnonzero(is_str)
+    fast = strings.str.fullmatch(_ROW).to_numpy(dtype=bool)
+    text = _SEP.join(strings[fast]) + _SEP
+
+    # restricted grammar: one findall over the column and one pass converting the tokens
+    tokens = _TOKEN.findall(text) if len(strings) else []
+    values = [
+        t[1:-1] if t[0] in '\'"' else float(t) if '.' in t or 'e' in t or 'E' in t else int(t)
+        for t in tokens if t != _SEP
+    ]
+    # the k-th separator closes row k
+    ends = [i for i, t in enumerate(tokens) if t == _SEP]
+    ends = np.asarray(ends, dtype=int) - np.arange(len(ends))
+    starts = np.concatenate([[0], ends[:-1]]).astype(int)
+    for position, start, end in zip(string_pos[fast], starts, ends):
+        result[position] = values[start:end]
+
+    # anything else the grammar does not cover, e.g. escaped quotes
+    for position, value in zip(string_pos[~fast], strings[~fast]):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(value, (list, tuple)):
+            result[position] = list(value)
+
+    for position, value in zip(np.flatnonzero(is_list), serialized[is_list]):
+        result[position] = list(value)
+
+    malformed = np.array([position for position, value in enumerate(result) if value is None], dtype=int)
+    return pd.Series(result, index=serialized.index, dtype=object), malformed
+
+
+def parse_list_columns(data: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Parses the serialized list columns of a frame, dropping rows where any of them is malformed.
+
+    Args:
+        data (pd.DataFrame): Frame, e.g. a chunk of journeys.
+        columns (list[str]): List columns to parse, missing ones are skipped.
+
+    Returns:
+        pd.DataFrame: Frame with list columns holding Python lists and without the malformed rows,
+        which are logged with their index.
+    """
+    data = data.copy()
+    keep = np.ones(len(data), dtype=bool)
+    for column in columns:
+        if column in data.columns:
+            data[column], malformed = parse_lists(data[column])
+            if len(malformed):
+                logger.warning('%d rows with a malformed %s list, e.g. index %s',
+                               len(malformed), column, list(data.index[malformed[:5]]))
+            keep[malformed] = False
+
+    return data[keep]
@@ -68,28 +68,32 @@ def fig_attribution_result(attribution_result, attribution_name):
         color_continuous_scale=colorscale,
     )
     return fig
-def draw_mmm_result(lr, X, y):
+def draw_mmm_result(lr, X=None, y=None):
     """
     Builds an area chart showing the budget allocation across channels using MMM results.
 
     Args:
-        lr (LinearRegression): Trained linear regression model.
-        X (pd.DataFrame): Feature matrix used for training the model.
-        y (pd.Series): Target variable used for training the model.
+        lr (LinearRegression or MediaMixModel): Trained linear regression model, or an adstock and
+            saturation model whose daily contributions are plotted as they are.
+        X (pd.DataFrame): Feature matrix used for training the linear regression.
+        y (pd.Series): Target variable used for training the linear regression.
 
     Returns:
         plotly.graph_objs._figure.Figure: Area chart figure.
     """
-    weights = pd.Series(lr.coef_, index=X.columns)
-    base = lr.intercept_
+    if hasattr(lr, 'contributions'):
+        adj_contributions = lr.contributions()
+    else:
+        weights = pd.Series(lr.coef_, index=X.columns)
+        base = lr.intercept_
 
-    # Calculate unadjusted and adjusted contributions
-    unadj_contributions = X.mul(weights).assign(Base=base)
-    adj_contributions = (
-        unadj_contributions
-        .div(unadj_contributions.sum(axis=1), axis=0)
-        .mul(y, axis=0)
-    )
+        # Calculate unadjusted and adjusted contributions
+        unadj_contributions = X.mul(weights).assign(Base=base)
+        adj_contributions = (
+            unadj_contributions
+            .div(unadj_contributions.sum(axis=1), axis=0)
+            .mul(y, axis=0)
+        )
 
     fig = px.area(
         adj_contributions[['facebook-ads', 'google-ads', 'tiktok-ads', 
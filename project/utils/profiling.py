@@ -0,0 +1,219 @@
+import time
+import tracemalloc
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+# the run being recorded in this thread/context, None when profiling is off
+_current: ContextVar = ContextVar('profile', default=None)
+
+
+class _Stage:
+    """
+    One open stage of a Profile, see stage().
+    """
+
+    def __init__(self, profile: 'Profile', name: str, counts: Dict[str, int]) -> None:
+        self.profile: Profile        = profile
+        self.name:    str            = name
+        self.counts:  Dict[str, int] = counts
+
+    def count(self, **counts: int) -> None:
+        self.counts.update(counts)
+
+    def __enter__(self) -> '_Stage':
+        self.profile._open(self)
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.profile._close(self)
+        return False
+
+
+class _NullStage:
+    """
+    What stage() hands out when profiling is off: one shared object that does nothing.
+    """
+
+    def count(self, **counts: int) -> None:
+        pass
+
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profile:
+    """
+    Records the stages run inside `with Profile(...)`.
+
+    Every stage keeps its wall time, the counts passed to it (rows, paths, ...) and, with memory=True,
+    its peak traced memory above what was allocated when it started. Stages nest: a stage opened inside
+    another one is reported as parent/child, and a stage run several times (e.g. once per chunk) is
+    reported once with its calls, total time, summed counts and largest peak.
+    """
+
+    def __init__(self, name: str = 'run', memory: bool = False) -> None:
+        self.name:    str        = name
+        self.memory:  bool       = memory
+        self.records: List[dict] = []
+        self.seconds: float      = 0.0
+        self.peak_mb: Optional[float] = None
+        self._stack:  List[list] = []
+        self._token = None
+        self._tracing = False
+
+    def start(self) -> 'Profile':
+        """
+        Starts recording, for code that cannot sit in a with block (e.g. a Streamlit script).
+        """
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._token = _current.set(self)
+        self._root = _Stage(self, self.name, {})
+        self._open(self._root)
+        return self
+
+    def stop(self) -> 'Profile':
+        self._close(self._root)
+        root = self.records.pop()
+        self.seconds, self.peak_mb = root['seconds'], root['peak_mb']
+        _current.reset(self._token)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        return self
+
+    def __enter__(self) -> 'Profile':
+        return self.start()
+
+    def __exit__(self, *exc) -> bool:
+        self.stop()
+        return False
+
+    def _open(self, stage: _Stage) -> None:
+        # frame: stage, path, start time, traced memory at start, peak traced memory so far
+        current = peak = None
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][4] = max(self._stack[-1][4], peak)
+            tracemalloc.reset_peak()
+            peak = current
+        # the run itself is the root, its stages are named from the first level down
+        path = f'{self._stack[-1][1]}/{stage.name}' if len(self._stack) > 1 else stage.name
+        self._stack.append([stage, path, time.perf_counter(), current, peak])
+
+    def _close(self, stage: _Stage) -> None:
+        seconds = time.perf_counter()
+        frame = self._stack.pop()
+        seconds -= frame[2]
+        peak_mb = None
+        if self.memory:
+            frame[4] = max(frame[4], tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                self._stack[-1][4] = max(self._stack[-1][4], frame[4])
+            peak_mb = (frame[4] - frame[3]) / 2**20
+        self.records.append({'stage': frame[1], 'seconds': seconds, 'peak_mb': peak_mb, **stage.counts})
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: run name, total seconds, peak_mb and one entry per stage path in the order the stages
+            first finished: calls, seconds, share of the run time, peak_mb and the summed counts.
+        """
+        stages: Dict[str, dict] = {}
+        for record in self.records:
+            entry = stages.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                        'share': 0.0, 'peak_mb': None})
+            entry['calls'] += 1
+            entry['seconds'] += record['seconds']
+            if record['peak_mb'] is not None:
+                entry['peak_mb'] = max(entry['peak_mb'] or 0.0, record['peak_mb'])
+            for key, value in record.items():
+                if key not in ('stage', 'seconds', 'peak_mb'):
+                    entry[key] = entry.get(key, 0) + value
+        for entry in stages.values():
+            entry['share'] = entry['seconds'] / self.seconds if self.seconds else 0.0
+
+        return {'run': self.name, 'seconds': self.seconds, 'peak_mb': self.peak_mb, 'stages': list(stages.values())}
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: The stages of report() as a table.
+        """
+        return pd.DataFrame(self.report()['stages'])
+
+
+def enabled() -> bool:
+    return _current.get() is not None
+
+
+def stage(name: str, **counts: int):
+    """
+    Context manager timing a stage of the current Profile; a shared no-op when none is active.
+
+    Args:
+        name (str): Stage name, nested stages are reported as parent/name.
+        **counts (int): Sizes to report with the stage, e.g. rows=len(data); more can be added
+            while it runs with .count(paths=...).
+    """
+    profile = _current.get()
+    if profile is None:
+        return _NULL_STAGE
+    return _Stage(profile, name, counts)
+
+
+def timed(name: str = None, **counts: Callable) -> Callable:
+    """
+    Decorator running a function as a stage of the current Profile.
+
+    Args:
+        name (str): Stage name, the function name if None.
+        **counts (callable): Sizes to report, computed from the call arguments, e.g.
+            paths=lambda self, *args, **kwargs: len(self.journeys). Only evaluated while profiling.
+    """
+    def decorator(fn: Callable) -> Callable:
+        label = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            with _Stage(profile, label, {key: count(*args, **kwargs) for key, count in counts.items()}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """
+    Runs every step of an iterator (e.g. reading the next chunk of a source) as a stage of the current
+    Profile, counting the rows of what it yields.
+
+    Args:
+        name (str): Stage name.
+        iterable (iterable): Items to time.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as step:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            if hasattr(item, '__len__'):
+                step.count(rows=len(item))
+        yield item
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+from utils.cache import LRUCache
+from utils.model import MediaMixModel, geometric_adstock, hill_saturation
+
+
+class ScenarioEngine:
+    """
+    What-if revenue of a fitted MediaMixModel under other spend allocations over the same days.
+
+    A scenario is a mix matrix M (channels x channels): channel j spends sum_i M[i, j] * spend_i on
+    every day, e.g. the identity is the actual spend and moving a share x of facebook-ads to tiktok-ads
+    moves x of facebook's daily spend into tiktok. Adstock is linear, so the adstocked spend of every
+    source channel under the decay of every target channel is computed once; a batch of scenarios is
+    then one contraction with those curves and one pass through the saturation curves.
+
+    Budget allocations (shares of the actual daily total spend) are the mix matrices with identical
+    rows. Their revenue is a sum of one curve per channel, which is what optimize maximizes. The curves
+    have to be non-negative and non-decreasing in spend, so models with a negative channel coefficient
+    are rejected (MediaMixModel.fit never produces one).
+    """
+
+    def __init__(self, mmm: MediaMixModel) -> None:
+        negative = [channel for channel, coef in zip(mmm.channels, mmm.coef) if coef < 0]
+        if negative:
+            raise ValueError(f'negative media coefficients for {", ".join(negative)}, refit the model with MediaMixModel.fit')
+        self.mmm:      MediaMixModel = mmm
+        self.channels: List[str] = mmm.channels
+        # days x source channel x target channel
+        self.adstocked: np.ndarray = geometric_adstock(mmm.spend, mmm.decay).transpose(1, 2, 0)
+        # days x channel: the daily total spend adstocked with every channel's decay
+        self.total_adstocked: np.ndarray = geometric_adstock(mmm.spend.sum(axis=1, keepdims=True), mmm.decay)[:, :, 0].T
+        self.history_shares: np.ndarray = mmm.spend.sum(axis=0) / max(mmm.spend.sum(), 1e-12)
+        self.cache: LRUCache = LRUCache(maxsize=32)
+
+    def _revenue(self, adstocked: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            adstocked (np.ndarray): Scenarios x days x channels.
+
+        Returns:
+            np.ndarray: Revenue over the days per scenario.
+        """
+        response = hill_saturation(adstocked, self.mmm.half_saturation, self.mmm.slope)
+        return response.sum(axis=1) @ self.mmm.coef + self.mmm.intercept * adstocked.shape[1]
+
+    @staticmethod
+    def _batch_size(entries: int) -> int:
+        # scenarios per batch, keeping the intermediate arrays at around 4e6 entries
+        return max(1, int(4e6) // max(entries, 1))
+
+    def evaluate(self, mixes: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            mixes (np.ndarray): Scenarios x channels x channels mix matrices (see ScenarioEngine).
+
+        Returns:
+            np.ndarray: Revenue over the model's days per scenario.
+        """
+        mixes = np.asarray(mixes, dtype=float).reshape(-1, len(self.channels), len(self.channels))
+        days = self.adstocked.shape[0]
+        step = self._batch_size(days * len(self.channels) ** 2)
+
+        revenue = np.empty(len(mixes))
+        for begin in range(0, len(mixes), step):
+            batch = mixes[begin:begin + step]
+            revenue[begin:begin + step] = self._revenue(np.einsum('sij,tij->stj', batch, self.adstocked, optimize=True))
+        return revenue
+
+    def evaluate_allocations(self, shares: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            shares (np.ndarray): Scenarios x channels, spend of every channel as a share of the actual
+                daily total (rows summing to 1.2 spend 20% more).
+
+        Returns:
+            np.ndarray: Revenue over the model's days per scenario.
+        """
+        shares = np.atleast_2d(np.asarray(shares, dtype=float))
+        step = self._batch_size(self.total_adstocked.size)
+
+        revenue = np.empty(len(shares))
+        for begin in range(0, len(shares), step):
+            batch = shares[begin:begin + step]
+            revenue[begin:begin + step] = self._revenue(batch[:, None, :] * self.total_adstocked[None])
+        return revenue
+
+    def shift(self, source: str, target: str, shares) -> np.ndarray:
+        """
+        Args:
+            source (str): Channel giving up spend.
+            target (str): Channel receiving it.
+            shares (array-like): Shares of the source's spend moved, one scenario each.
+
+        Returns:
+            np.ndarray: Mix matrices of the scenarios.
+        """
+        shares = np.atleast_1d(np.asarray(shares, dtype=float))
+        i, j = self.channels.index(source), self.channels.index(target)
+        mixes = np.repeat(np.eye(len(self.channels))[None], len(shares), axis=0)
+        mixes[:, i, i] -= shares
+        mixes[:, i, j] += shares
+        return mixes
+
+    def optimize(self,
+                 budget: float = 1.0,
+                 min_shares: Dict[str, float] = None,
+                 max_shares: Dict[str, float] = None,
+                 resolution: int = 200) -> pd.DataFrame:
+        """
+        Revenue-maximizing allocation of a total budget, cached per engine (i.e. per fitted model).
+
+        The revenue of an allocation is a sum of one curve per channel, so every curve is tabulated on a
+        grid of budget units in one pass and the best split of the units is found exactly by dynamic
+        programming over the channels, which also handles S-shaped (slope > 1) curves.
+
+        Args:
+            budget (float): Total spend relative to the actual one (1 = same total).
+            min_shares (dict): Channel -> least share of the budget it has to get.
+            max_shares (dict): Channel -> largest share of the budget it may get.
+            resolution (int): Budget units; shares are multiples of 1 / resolution.
+
+        Returns:
+            pd.DataFrame: Per channel the actual and the optimal share of the budget and the revenue
+            each allocation attributes to it; attrs hold the total revenue of both and of the base.
+        """
+        key = (budget, tuple(sorted((min_shares or {}).items())), tuple(sorted((max_shares or {}).items())), resolution)
+        return self.cache.get_or_compute(key, self._optimize, budget, min_shares or {}, max_shares or {}, resolution)
+
+    def _optimize(self, budget: float, min_shares: Dict[str, float], max_shares: Dict[str, float], resolution: int) -> pd.DataFrame:
+        n_channels = len(self.channels)
+        units = np.arange(resolution + 1)
+
+        # channel x units: revenue of every channel when it gets k units of the budget
+        response = hill_saturation(units[None, :, None] * (budget / resolution) * self.total_adstocked.T[:, None, :],
+                                   self.mmm.half_saturation[:, None, None], self.mmm.slope[:, None, None])
+        curves = response.sum(axis=2) * self.mmm.coef[:, None]
+
+        low = np.array([np.ceil(min_shares.get(c, 0.0) * resolution - 1e-9) for c in self.channels], dtype=int)
+        high = np.array([np.floor(max_shares.get(c, 1.0) * resolution + 1e-9) for c in self.channels], dtype=int)
+        if low.sum() > resolution or (low > high).any():
+            raise ValueError('the minimum shares do not fit into the budget')
+        curves = np.where((units >= low[:, None]) & (units <= high[:, None]), curves, -np.inf)
+
+        # best[b]: best revenue of the channels so far with b units spent
+        best = np.where(units == 0, 0.0, -np.inf)
+        picks = np.zeros((n_channels, resolution + 1), dtype=int)
+        spent = units[:, None] - units[None, :]
+        for c in range(n_channels):
+            candidates = np.where(spent >= 0, best[np.clip(spent, 0, None)] + curves[c][None, :], -np.inf)
+            picks[c] = candidates.argmax(axis=1)
+            best = candidates.max(axis=1)
+
+        # the budget is an upper bound: spending less is allowed when it earns more
+        left = int(np.argmax(best))
+        allocation = np.zeros(n_channels, dtype=int)
+        for c in reversed(range(n_channels)):
+            allocation[c] = picks[c][left]
+            left -= allocation[c]
+
+        shares = allocation / resolution
+        history = self.history_shares * budget
+        base = self.mmm.intercept * self.total_adstocked.shape[0]
+        channel_revenue = lambda s: hill_saturation(s[None, :] * self.total_adstocked, self.mmm.half_saturation,
+                                                    self.mmm.slope).sum(axis=0) * self.mmm.coef
+
+        result = pd.DataFrame({
+            'actual_share': history / budget,
+            'optimal_share': shares,
+            'actual_revenue': channel_revenue(history),
+            'optimal_revenue': channel_revenue(shares * budget),
+        }, index=pd.Index(self.channels, name='channel'))
+        result.attrs = {'budget': budget,
+                        'base': base,
+                        'actual_total': base + result['actual_revenue'].sum(),
+                        'optimal_total': base + result['optimal_revenue'].sum()}
+        return result
+
+
+def scenario_engines(models: Dict[str, MediaMixModel]) -> Dict[str, ScenarioEngine]:
+    """
+    Args:
+        models (dict): Shop -> fitted model, e.g. from fit_mmm_shops.
+
+    Returns:
+        dict: Shop -> ScenarioEngine.
+    """
+    return {shop: ScenarioEngine(mmm) for shop, mmm in models.items()}
@@ -0,0 +1,91 @@
+import sys
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from typing import List, Optional
+
+from utils.parsing import parse_list_columns
+
+JOURNEYS_PATH = 'data/journeys'
+
+# journeys are stored as <root>/shop_name=<shop>/journey_date=<YYYY-MM-DD>/*.parquet
+PARTITIONING = ds.partitioning(pa.schema([('shop_name', pa.string()), ('journey_date', pa.date32())]),
+                               flavor='hive')
+
+# columns holding serialized lists in CSV exports
+LIST_COLUMNS = ['tw_source', 'tw_adid', 'ad_list', 'time_between_order_and_step']
+
+
+def convert_journeys(src: str, dst: str = JOURNEYS_PATH) -> None:
+    """
+    One-off conversion of a journeys pickle/CSV (the data_for_mvp format) into the partitioned
+    Parquet dataset read by load_journeys. Partitions already present in dst are overwritten.
+
+    Args:
+        src (str): Path to a .pickle or .csv file.
+        dst (str): Root directory of the dataset.
+    """
+    if src.endswith('.csv'):
+        data = pd.read_csv(src, index_col=0)
+    else:
+        data = pd.read_pickle(src)
+    # lists are parsed once here and stored as Parquet list columns (values + offsets), rows with a
+    # malformed list are logged and left out
+    data = parse_list_columns(data, LIST_COLUMNS)
+
+    data = data.reset_index(drop=True)
+    data['journey_end_ts'] = pd.to_datetime(data['journey_end_ts'])
+    data['journey_date'] = data['journey_end_ts'].dt.date
+
+    ds.write_dataset(pa.Table.from_pandas(data, preserve_index=False), dst,
+                     format='parquet',
+                     partitioning=PARTITIONING,
+                     existing_data_behavior='delete_matching')
+
+
+def load_journeys(root: str = JOURNEYS_PATH,
+                  shop: Optional[str] = None,
+                  start_date=None,
+                  end_date=None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads a slice of the journeys dataset; only the partitions of the shop and dates and only the
+    requested columns are read.
+
+    Args:
+        root (str): Root directory of the dataset.
+        shop (str): Shop name, all shops if None.
+        start_date (datetime.date): First day (inclusive) by journey_end_ts, unbounded if None.
+        end_date (datetime.date): Last day (inclusive), unbounded if None.
+        columns (list[str]): Columns to read, all if None.
+
+    Returns:
+        pd.DataFrame: Journeys with list columns as Python lists.
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+
+    conditions = []
+    if shop is not None:
+        conditions.append(ds.field('shop_name') == shop)
+    if start_date is not None:
+        conditions.append(ds.field('journey_date') >= pd.Timestamp(start_date).date())
+    if end_date is not None:
+        conditions.append(ds.field('journey_date') <= pd.Timestamp(end_date).date())
+
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+
+    table = dataset.to_table(columns=columns, filter=condition)
+    data = table.to_pandas()
+    # pyarrow hands out numpy arrays for list cells, the app works with lists
+    for column in LIST_COLUMNS:
+        if column in data.columns:
+            data[column] = table.column(column).to_pylist()
+
+    return data
+
+
+if __name__ == "__main__":
+
+    convert_journeys(*sys.argv[1:3])